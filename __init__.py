@@ -8,15 +8,21 @@ import importlib
 import threading
 from queue import Queue
 
+from calibre.ebooks.metadata import check_isbn
 from calibre.ebooks.metadata.sources.base import Source
-from calibre.utils.config import JSONConfig
+
+MAX_COVER_PROBES = 20
+
+
+# the prefs module is imported on first use, calibre loads every plugin class at startup
+class LazyPrefs:
+    def __get__(self, instance, owner):
+        return owner.load('prefs').prefs
 
 
 class Wbibliotece(Source):
     IDENTIFIER = 'wbibliotece'
     BOOK_PAGE_URL_SCHEME = 'https://w.bibliotece.pl/{}'
-    covers = []
-    identified = False
 
     # generic plugin options
     name = 'w.bibliotece.pl'
@@ -35,7 +41,15 @@ class Wbibliotece(Source):
     auto_trim_covers = False
     cached_cover_url_is_reliable = True
     prefer_results_with_isbn = True
-    prefs = JSONConfig('plugins/' + IDENTIFIER)
+    prefs = LazyPrefs()
+    modules = {}
+
+    @classmethod
+    def load(cls, name):
+        module = cls.modules.get(name)
+        if module is None:
+            module = cls.modules[name] = importlib.import_module('calibre_plugins.{}.{}'.format(cls.IDENTIFIER, name))
+        return module
 
     def get_book_url(self, identifiers):
         book_id = identifiers.get(self.IDENTIFIER, None)
@@ -46,51 +60,204 @@ class Wbibliotece(Source):
             return None
 
     def identify(self, log, result_queue, abort, title=None, authors=None, identifiers={}, timeout=30):
-        self.cache_identifier_to_cover_url('urls', [])
-        parser_module = importlib.import_module('calibre_plugins.{}.parser'.format(self.IDENTIFIER))
-        parser = parser_module.Parser(self, log, timeout)
-        urls = parser.parse_search_page(title, authors, with_authors=self.prefs['authors_search'], only_first_author=self.prefs['only_first_author'])
+        self.identify_books(log, result_queue, abort, title, authors, identifiers, timeout)
+
+    # returns the book page urls the job read, best match first
+    def identify_books(self, log, result_queue, abort, title, authors, identifiers, timeout):
+        parser_module = self.load('parser')
+        stats_module = self.load('stats')
+        parser = parser_module.Parser.get_instance(self, log, timeout, abort)
+        parser.set_query(title, authors)
+        try:
+            with parser.stats.timer('identify'):
+                return self.run_identify(parser, log, result_queue, abort, title, authors, identifiers)
+        finally:
+            stats_module.report(log, 'Identify', parser.stats, self.prefs)
+
+    def run_identify(self, parser, log, result_queue, abort, title, authors, identifiers, parallel=True):
+        isbn = check_isbn(identifiers.get('isbn', None))
+
+        # known book id, go straight to the book page
         t = self.get_book_url(identifiers)
         if t:
-            urls.insert(0, t[2])
-        if abort.is_set():
-            return
-
-        for url in urls[:self.prefs['max_results']]:
-            mi = parser.parse_book_page(url)
+            log.info('INFO: Found identifier, skipping search: ' + t[1])
+            mi = parser.parse_book_page(t[2])
             if mi:
-                # self.clean_downloaded_metadata(mi)
                 result_queue.put(mi)
+                parser.index_books([t[2]])
+                return [t[2]]
+            log.warn('WARN: Book page not available, falling back to search')
+        if abort.is_set():
+            return []
+
+        # book resolved by an earlier run
+        if parser.index is not None:
+            book_id = parser.index.lookup(title, authors, isbn)
+            if book_id and (not t or book_id != t[1]):
+                log.info('INFO: Found book in identifier index, skipping search: ' + book_id)
+                url = self.BOOK_PAGE_URL_SCHEME.format(book_id)
+                mi = parser.parse_book_page(url)
+                if mi:
+                    result_queue.put(mi)
+                    return [url]
+                log.warn('WARN: Indexed book page not available, removing from index: ' + book_id)
+                parser.index.invalidate(book_id)
             if abort.is_set():
-                return
+                return []
+
+        urls = parser.search(title, authors, isbn, parallel=self.prefs['threads'] and parallel)
+        if abort.is_set():
+            return []
 
-        return
+        urls = urls[:self.prefs['max_results']]
+        if self.prefs['threads'] and parallel and len(urls) > 1:
+            parser.parse_book_pages(urls, result_queue, abort)
+        else:
+            for url in urls:
+                mi = parser.parse_book_page(url)
+                if mi:
+                    # self.clean_downloaded_metadata(mi)
+                    result_queue.put(mi)
+                if abort.is_set():
+                    return urls
+        if not abort.is_set():
+            parser.index_books(urls, isbn)
+        return urls
 
     # cover reladed functions
     def get_cached_cover_url(self, identifiers):
-        return self.cached_identifier_to_cover_url('urls')
+        covers_module = self.load('covers')
+        return covers_module.cover_cache.get(identifiers, covers_module.CoverStore.get_instance(self.prefs))
 
     def download_cover(self, log, result_queue, abort, title=None, authors=None, identifiers={}, timeout=30, get_best_cover=False):
         if not self.prefs['covers']:
             return
 
+        stats_module = self.load('stats')
+        stats = stats_module.Stats()
+        try:
+            with stats.timer('cover'):
+                self.run_download_cover(log, result_queue, abort, title, authors, identifiers, timeout, get_best_cover, stats)
+        finally:
+            stats_module.report(log, 'Cover', stats, self.prefs)
+
+    def run_download_cover(self, log, result_queue, abort, title, authors, identifiers, timeout, get_best_cover, stats):
+
         urls = self.get_cached_cover_url(identifiers)
-        if not urls and not self.cached_identifier_to_cover_url('nocover'):
-            log.info('INFO: No cached cover, need to run identify')
-            rq = Queue()
-            self.identify(log, rq, abort, title, authors, identifiers, timeout)
+        t = self.get_book_url(identifiers)
+        if urls is None and t:
+            # known book, only the covers box of its page is needed
+            log.info('INFO: No cached cover, reading book page: ' + t[1])
+            parser_module = self.load('parser')
+            parser = parser_module.Parser.get_instance(self, log, timeout, abort)
+            parser.set_query(title, authors)
+            parser.parse_book_page(t[2], parser_module.FieldPlan((), covers=True))
             urls = self.get_cached_cover_url(identifiers)
-        elif not urls:
+        if urls is None and not abort.is_set():
+            log.info('INFO: No cached cover, need to run identify')
+            fields_module = self.load('fields')
+            # found books are looked up by the id in their url, the metadata only carries it with the identifier pref on
+            for url in self.identify_books(log, Queue(), abort, title, authors, identifiers, timeout):
+                urls = self.get_cached_cover_url({self.IDENTIFIER: fields_module.book_id(url)})
+                if urls:
+                    break
+        if not urls:
             log.warn('WARN: No cover available')
             return
-        else:
-            log.info('INFO: Found covers in cache')
+        log.info('INFO: Found covers in cache')
 
-        if self.prefs['threads']:
-            self.download_multiple_covers(title, authors, urls, get_best_cover, timeout, result_queue, abort, log)
-        else:
-            for cover in urls[:self.prefs['max_covers']]:
-                self.download_image(cover, timeout, log, result_queue)
+        self.download_multiple_covers(title, authors, urls, get_best_cover, timeout, result_queue, abort, log, stats)
+
+    def get_network(self, timeout, log, stats=None, abort=None):
+        network_module = self.load('network')
+        return network_module.Network.get_instance(timeout, log, self.prefs, stats, abort)
+
+    def download_image(self, url, timeout, log, result_queue=None, stats=None, abort=None):
+        log.info('INFO: Downloading cover: ' + url)
+        resp = self.get_network(timeout, log, stats, abort).download_page(url)
+        if not resp:
+            return
+        try:
+            cdata = resp.read()
+        except Exception as e:
+            log.error('ERROR: Cover download failed: ' + url)
+            log.exception(e)
+            return
+        if not cdata:
+            log.warn('WARN: Empty cover: ' + url)
+            return
+        if result_queue is not None and not (abort is not None and abort.is_set()):
+            result_queue.put((self, cdata))
+        return cdata
+
+    def run_workers(self, items, func, abort, log):
+        scheduler_module = self.load('scheduler')
+        threads = self.prefs['max_threads'] if self.prefs['threads'] else 1
+        return scheduler_module.run_workers(items, func, abort, log, threads, self.prefs['thread_delay'])
+
+    def probe_cover(self, url, timeout, log, stats=None, abort=None):
+        # format, dimensions and size of a cover read from its first bytes
+        network_module = self.load('network')
+        utils_module = self.load('utils')
+        network = self.get_network(timeout, log, stats, abort)
+        length = network_module.PROBE_SIZE
+        while True:
+            result = network.probe(url, length)
+            if result is None:
+                return None
+            head, total = result
+            size = utils_module.Utils.get_image_size(head)
+            # progressive jpegs can carry large exif blocks before the frame header
+            if size or len(head) < length or length > network_module.PROBE_SIZE * 4 or head[:2] != b'\xff\xd8':
+                return size, total
+            length *= 4
+
+    def download_multiple_covers(self, title, authors, urls, get_best_cover, timeout, result_queue, abort, log, stats=None):
+        # the same image is often linked with different query strings
+        seen = set()
+        candidates = []
+        for url in urls:
+            key = url.partition('?')[0]
+            if key not in seen:
+                seen.add(key)
+                candidates.append(url)
+        candidates = candidates[:MAX_COVER_PROBES]
+        wanted = 1 if get_best_cover else self.prefs['max_covers']
+        if len(candidates) <= wanted:
+            # every candidate is returned anyway, probing would only cost requests
+            self.download_covers(candidates, wanted, timeout, result_queue, abort, log, stats)
+            return
+
+        probes = self.run_workers(candidates, lambda url: self.probe_cover(url, timeout, log, stats, abort), abort, log)
+        if abort.is_set():
+            return
+
+        ranked = []
+        seen = set()
+        for url, probe in zip(candidates, probes):
+            if probe is None:
+                continue
+            size, total = probe
+            if size and total:
+                if (size, total) in seen:
+                    log.info('INFO: Duplicate cover skipped: ' + url)
+                    continue
+                seen.add((size, total))
+            # unknown sizes keep their page order after the measured ones
+            ranked.append(((size[0] * size[1] if size else 0, total or 0), url))
+        ranked.sort(key=lambda r: r[0], reverse=True)
+        ranked = [url for rank, url in ranked]
+        if get_best_cover and ranked:
+            log.info('INFO: Best cover: ' + ranked[0])
+        self.download_covers(ranked, wanted, timeout, result_queue, abort, log, stats)
+
+    # only the covers that are returned get downloaded in full, each one is queued as soon as it
+    # arrives and the next candidate replaces a failed one
+    def download_covers(self, urls, wanted, timeout, result_queue, abort, log, stats=None):
+        while urls and wanted > 0 and not abort.is_set():
+            batch, urls = urls[:wanted], urls[wanted:]
+            images = self.run_workers(batch, lambda url: self.download_image(url, timeout, log, result_queue, stats, abort), abort, log)
+            wanted -= len([cdata for cdata in images if cdata])
 
     # plugin configuraton window
 
@@ -98,7 +265,7 @@ class Wbibliotece(Source):
         return True
 
     def config_widget(self):
-        config_widget = importlib.import_module('calibre_plugins.{}.config'.format(self.IDENTIFIER))
+        config_widget = self.load('config')
         return config_widget.ConfigWidget()
 
     def save_settings(self, config_widget):
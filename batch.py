@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Batch identify for whole-library metadata refresh.
+#
+#   calibre-debug -e batch.py -- --library ~/Calibre\ Library --output results.jsonl
+#   calibre-debug -e batch.py -- --library ~/Calibre\ Library --ids 1,2,3 --apply-identifiers
+import os
+import sys
+import json
+import argparse
+import importlib
+import importlib.util
+import threading
+import types
+from queue import Queue, Empty
+
+IDENTIFIER = 'wbibliotece'
+PLUGIN = 'calibre_plugins.' + IDENTIFIER
+
+
+class BatchIdentify:
+    def __init__(self, plugin, log, timeout=30, max_threads=None):
+        self.plugin = plugin
+        self.log = log
+        self.timeout = timeout
+        self.max_threads = max(max_threads or plugin.prefs['max_threads'], 1)
+        self.parser_module = importlib.import_module(PLUGIN + '.parser')
+        self.stats_module = importlib.import_module(PLUGIN + '.stats')
+        self.normalize = importlib.import_module(PLUGIN + '.normalize')
+
+    def query_key(self, title, authors, identifiers):
+        authors = tuple(sorted(self.normalize.normalize_text(author) for author in authors or []))
+        identifiers = tuple(sorted((identifiers or {}).items()))
+        return (self.normalize.normalize_text(title), authors, identifiers)
+
+    # every worker keeps one Parser for all the books it handles
+    def worker(self, jobs, done, stop, parsers):
+        parser = self.parser_module.Parser.get_instance(self.plugin, self.log, self.timeout, stop)
+        parsers.append(parser)
+        while not stop.is_set():
+            try:
+                indices, (title, authors, identifiers) = jobs.get_nowait()
+            except Empty:
+                return
+            result_queue = Queue()
+            parser.set_query(title, authors)
+            try:
+                with parser.stats.timer('identify'):
+                    self.plugin.run_identify(parser, self.log, result_queue, stop, title, authors, identifiers or {}, parallel=False)
+            except Exception as e:
+                self.log.error('ERROR: Identify failed: {}'.format(title))
+                self.log.exception(e)
+            results = []
+            while not result_queue.empty():
+                results.append(result_queue.get_nowait())
+            done.put((indices, results))
+
+    # books is an iterable of (title, authors, identifiers), yields (index, [Metadata]) as books finish
+    def identify(self, books, abort=None):
+        queries = {}
+        for index, book in enumerate(books):
+            key = self.query_key(*book)
+            if key in queries:
+                queries[key][0].append(index)
+            else:
+                queries[key] = ([index], book)
+
+        jobs = Queue()
+        for job in queries.values():
+            jobs.put(job)
+        done = Queue()
+        # stops the workers on abort and when the caller closes the generator early
+        stop = threading.Event()
+        parsers = []
+        workers = []
+        for i in range(min(self.max_threads, len(queries))):
+            if i and stop.wait(self.plugin.prefs['thread_delay']):
+                break
+            worker = threading.Thread(target=self.worker, args=(jobs, done, stop, parsers), daemon=True)
+            worker.start()
+            workers.append(worker)
+
+        try:
+            pending = len(queries)
+            while pending:
+                if abort is not None and abort.is_set():
+                    break
+                try:
+                    indices, results = done.get(timeout=0.1)
+                except Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        break
+                    continue
+                pending -= 1
+                # duplicated queries get their own copies of the shared results
+                yield indices[0], results
+                for index in indices[1:]:
+                    yield index, [mi.deepcopy_metadata() for mi in results]
+        finally:
+            stop.set()
+            stats = self.stats_module.Stats()
+            for parser in parsers:
+                stats.merge(parser.stats)
+            self.stats_module.report(self.log, 'Batch', stats, self.plugin.prefs)
+
+
+def metadata_to_json(mi):
+    return {
+        'title': mi.title,
+        'authors': mi.authors,
+        'identifiers': mi.get_identifiers(),
+        'publisher': mi.publisher,
+        'pubdate': mi.pubdate.isoformat() if mi.pubdate else None,
+        'series': mi.series,
+        'tags': mi.tags,
+        'rating': mi.rating,
+        'languages': mi.languages,
+    }
+
+
+# import the plugin from this source tree when run as a script
+def load_plugin_package():
+    if PLUGIN in sys.modules:
+        return sys.modules[PLUGIN]
+    root = os.path.dirname(os.path.abspath(__file__))
+    if 'calibre_plugins' not in sys.modules:
+        sys.modules['calibre_plugins'] = types.ModuleType('calibre_plugins')
+        sys.modules['calibre_plugins'].__path__ = []
+    spec = importlib.util.spec_from_file_location(PLUGIN, os.path.join(root, '__init__.py'), submodule_search_locations=[root])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PLUGIN] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Identify books of a calibre library with w.bibliotece.pl')
+    ap.add_argument('--library', required=True, help='path to the calibre library')
+    ap.add_argument('--ids', help='comma separated book ids, all books by default')
+    ap.add_argument('--output', help='write results as json lines, stdout by default')
+    ap.add_argument('--apply-identifiers', action='store_true', help='store the wbibliotece id of the first result in the library')
+    ap.add_argument('--threads', type=int, help='number of books identified at once')
+    ap.add_argument('--timeout', type=int, default=30)
+    ap.add_argument('--verbose', action='store_true')
+    args = ap.parse_args(argv)
+
+    from calibre.library import db
+    from calibre.utils.logging import Log
+
+    plugin_module = load_plugin_package()
+    plugin = plugin_module.Wbibliotece(None)
+    log = Log(level=Log.DEBUG if args.verbose else Log.WARN)
+
+    cache = db(os.path.expanduser(args.library)).new_api
+    book_ids = [int(i) for i in args.ids.split(',')] if args.ids else sorted(cache.all_book_ids())
+    books = [(cache.field_for('title', book_id), list(cache.field_for('authors', book_id)), cache.field_for('identifiers', book_id))
+             for book_id in book_ids]
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    found = {}
+    try:
+        for index, results in BatchIdentify(plugin, log, args.timeout, args.threads).identify(books):
+            book_id = book_ids[index]
+            out.write(json.dumps({'book_id': book_id, 'results': [metadata_to_json(mi) for mi in results]}, ensure_ascii=False) + '\n')
+            out.flush()
+            wbibliotece_id = results[0].get_identifiers().get(IDENTIFIER) if results else None
+            if wbibliotece_id:
+                found[book_id] = wbibliotece_id
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.apply_identifiers and found:
+        identifiers = {}
+        for book_id, wbibliotece_id in found.items():
+            identifiers[book_id] = dict(cache.field_for('identifiers', book_id), **{IDENTIFIER: wbibliotece_id})
+        cache.set_field('identifiers', identifiers)
+    print('Identified {} of {} books'.format(len(found), len(book_ids)), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
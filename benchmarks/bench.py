@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# Offline benchmark for the wbibliotece plugin, replays recorded w.bibliotece.pl pages.
+#
+#   calibre-debug -e benchmarks/bench.py -- --record            refresh fixtures from the live site
+#   calibre-debug -e benchmarks/bench.py -- --save-baseline b.json
+#   calibre-debug -e benchmarks/bench.py -- --baseline b.json   fail when a stage got slower
+#   calibre-debug -e benchmarks/bench.py -- --server            replay over a local HTTP server
+import os
+import sys
+import json
+import gzip
+import time
+import hashlib
+import argparse
+import importlib
+import importlib.util
+import threading
+import tracemalloc
+import types
+import http.server
+import urllib.parse
+from queue import Queue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures')
+QUERIES_FILE = os.path.join(ROOT, 'benchmarks', 'queries.json')
+PLUGIN = 'calibre_plugins.wbibliotece'
+
+
+# import the plugin from this source tree instead of the installed zip
+def load_plugin_package():
+    if 'calibre_plugins' not in sys.modules:
+        sys.modules['calibre_plugins'] = types.ModuleType('calibre_plugins')
+        sys.modules['calibre_plugins'].__path__ = []
+    spec = importlib.util.spec_from_file_location(PLUGIN, os.path.join(ROOT, '__init__.py'), submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PLUGIN] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class BenchLog:
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def info(self, *args):
+        if self.verbose:
+            print(*args)
+
+    warn = warning = debug = info
+
+    def error(self, *args):
+        print(*args, file=sys.stderr)
+
+    def exception(self, *args):
+        print(*args, file=sys.stderr)
+
+
+class FixtureResponse:
+    def __init__(self, status, headers):
+        self.status = status
+        self.reason = 'OK' if status < 300 else 'Fixture'
+        self.headers = {k.lower(): v for k, v in headers.items()}
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class Fixtures:
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self.responses = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.responses = json.load(f)['responses']
+
+    def get(self, url):
+        entry = self.responses.get(url)
+        if entry is None:
+            return None
+        with open(os.path.join(self.path, entry['file']), 'rb') as f:
+            return entry['status'], entry['headers'], f.read()
+
+    def put(self, url, status, headers, body):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(body)
+        self.responses[url] = {'file': name, 'status': status, 'headers': headers}
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'responses': self.responses}, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+
+def network_classes(network_module, fixtures, server_url=None):
+    Network = network_module.Network
+
+    class RecordingNetwork(Network):
+        def request(self, url, headers=None, read_limit=None):
+            resp, body = Network.request(self, url, headers, read_limit)
+            if read_limit:
+                return resp, body
+            fixtures.put(url, resp.status, {'Content-Type': resp.getheader('Content-Type', '')}, body)
+            return resp, body
+
+    class ReplayNetwork(Network):
+        def request(self, url, headers=None, read_limit=None):
+            entry = fixtures.get(url)
+            if entry is None:
+                return FixtureResponse(404, {}), b''
+            status, headers, body = entry
+            if read_limit:
+                return FixtureResponse(status, dict(headers, **{'Content-Length': str(len(body))})), body[:read_limit]
+            return FixtureResponse(status, headers), body
+
+    class ServerNetwork(Network):
+        def request(self, url, headers=None, read_limit=None):
+            return Network.request(self, server_url + urllib.parse.quote(url, safe=''), headers, read_limit)
+
+    return RecordingNetwork, ReplayNetwork, ServerNetwork
+
+
+# local stand-in for w.bibliotece.pl, exercises the connection pool and gzip path
+def start_server(fixtures):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            entry = fixtures.get(urllib.parse.unquote(self.path[1:]))
+            status, headers, body = entry if entry else (404, {}, b'')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body, 1)
+                headers = dict(headers, **{'Content-Encoding': 'gzip'})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_port)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.log = BenchLog(args.verbose)
+        self.plugin_module = load_plugin_package()
+        self.parser_module = importlib.import_module(PLUGIN + '.parser')
+        self.check_isbn = importlib.import_module('calibre.ebooks.metadata').check_isbn
+        network_module = importlib.import_module(PLUGIN + '.network')
+        prefs_module = importlib.import_module(PLUGIN + '.prefs')
+        self.fixtures = Fixtures(args.fixtures)
+        self.server = None
+        server_url = None
+        if args.server:
+            self.server, server_url = start_server(self.fixtures)
+        recording, replay, server = network_classes(network_module, self.fixtures, server_url)
+        self.network_class = recording if args.record else server if args.server else replay
+
+        # the response cache, identifier index and rate limit would hide the parser cost
+        self.prefs = dict(prefs_module.prefs.defaults, cache=False, identifier_index=False, requests_per_second=1000.0)
+        for pref in args.pref:
+            key, _, value = pref.partition('=')
+            self.prefs[key] = json.loads(value)
+        self.timings = {}
+
+    def make_plugin(self):
+        bench = self
+
+        class BenchPlugin(self.plugin_module.Wbibliotece):
+            prefs = bench.prefs
+
+            def get_network(self, timeout, log, stats=None, abort=None):
+                return bench.network_class(timeout, log, self.prefs, stats, abort)
+
+        # identify builds its own Parser, make it use the replay network too
+        self.parser_module.Network = self.network_class
+        return BenchPlugin(None)
+
+    def timed(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.timings.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def run_query(self, query):
+        title, authors, identifiers = query['title'], query.get('authors', []), query.get('identifiers', {})
+        timeout = self.args.timeout
+
+        # per stage timings on a parser driven directly
+        plugin = self.make_plugin()
+        parser = self.parser_module.Parser(plugin, self.log, timeout)
+        parser.set_query(title, authors)
+        isbn = self.check_isbn(identifiers.get('isbn', None))
+        urls = self.timed('search', parser.search, title, authors, isbn, self.prefs['threads'])
+        for url in urls[:self.prefs['max_results']]:
+            self.timed('book', parser.parse_book_page, url)
+
+        # end to end, the way calibre calls the plugin
+        plugin = self.make_plugin()
+        abort = threading.Event()
+        result_queue = Queue()
+        self.timed('identify', plugin.identify, self.log, result_queue, abort, title, authors, identifiers, timeout)
+        books = result_queue.qsize()
+        cover_queue = Queue()
+        self.timed('cover', plugin.download_cover, self.log, cover_queue, abort, title, authors, identifiers, timeout, self.args.best_cover)
+        return books
+
+    def run(self, queries):
+        tracemalloc.start()
+        found = {}
+        start = time.perf_counter()
+        for _ in range(self.args.iterations):
+            for query in queries:
+                found[query['title']] = found.get(query['title'], 0) + self.run_query(query)
+        books = sum(found.values())
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if self.server:
+            self.server.shutdown()
+
+        report = {
+            'books': books,
+            # queries that resolved nothing, pages missing from the fixtures or a parser that broke
+            'empty': [title for title, count in found.items() if not count],
+            'elapsed': elapsed,
+            'books_per_second': books / sum(self.timings.get('identify', [])) if books else 0.0,
+            'peak_memory': peak,
+            'max_rss': max_rss(),
+            'stages': {},
+        }
+        for stage, values in self.timings.items():
+            report['stages'][stage] = {
+                'count': len(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+            }
+        return report
+
+
+def max_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def print_report(report):
+    print('books: {books}, elapsed: {elapsed:.3f}s, throughput: {books_per_second:.1f} books/s'.format(**report))
+    print('peak python memory: {:.1f} KiB, max rss: {}'.format(report['peak_memory'] / 1024, report['max_rss']))
+    print('{:<10} {:>6} {:>10} {:>10} {:>10}'.format('stage', 'count', 'mean ms', 'p50 ms', 'p95 ms'))
+    for stage, s in sorted(report['stages'].items()):
+        print('{:<10} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}'.format(stage, s['count'], s['mean'] * 1000, s['p50'] * 1000, s['p95'] * 1000))
+
+
+def compare(report, baseline, threshold):
+    regressions = []
+    for stage, s in sorted(report['stages'].items()):
+        base = baseline['stages'].get(stage)
+        if not base or not base['p50']:
+            continue
+        ratio = s['p50'] / base['p50']
+        mark = 'REGRESSION' if ratio > 1 + threshold else ''
+        print('{:<10} p50 {:>8.2f} ms -> {:>8.2f} ms ({:+.1f}%) {}'.format(stage, base['p50'] * 1000, s['p50'] * 1000, (ratio - 1) * 100, mark))
+        if mark:
+            regressions.append(stage)
+    return regressions
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Offline benchmark for the w.bibliotece.pl metadata source')
+    ap.add_argument('--fixtures', default=FIXTURES_DIR)
+    ap.add_argument('--queries', default=QUERIES_FILE)
+    ap.add_argument('--record', action='store_true', help='download the queries from the live site and refresh fixtures')
+    ap.add_argument('--server', action='store_true', help='replay through a local HTTP server instead of in process')
+    ap.add_argument('--iterations', type=int, default=5)
+    ap.add_argument('--timeout', type=int, default=30)
+    ap.add_argument('--best-cover', action='store_true')
+    ap.add_argument('--pref', action='append', default=[], help='override a plugin pref, e.g. --pref max_threads=1')
+    ap.add_argument('--baseline', help='compare with a saved report')
+    ap.add_argument('--threshold', type=float, default=0.10, help='allowed p50 slowdown against the baseline')
+    ap.add_argument('--save-baseline', help='write the report as json')
+    ap.add_argument('--verbose', action='store_true')
+    args = ap.parse_args(argv)
+
+    with open(args.queries, encoding='utf-8') as f:
+        queries = json.load(f)
+    if args.record:
+        args.iterations = 1
+    elif not os.path.exists(os.path.join(args.fixtures, 'manifest.json')):
+        print('ERROR: no fixtures in {}, run with --record first'.format(args.fixtures), file=sys.stderr)
+        return 1
+
+    bench = Bench(args)
+    report = bench.run(queries)
+    if args.record:
+        bench.fixtures.save()
+        print('Recorded {} responses to {}'.format(len(bench.fixtures.responses), args.fixtures))
+        return 0
+
+    print_report(report)
+    if report['empty']:
+        print('ERROR: no books found for: {}'.format(', '.join(report['empty'])), file=sys.stderr)
+        return 1
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
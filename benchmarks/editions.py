@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Book pages with many editions, times the publishers block from parsing to the edition year range.
+#
+#   calibre-debug -e benchmarks/editions.py
+#   calibre-debug -e benchmarks/editions.py -- --editions 10,200,1000 --iterations 50
+import os
+import io
+import re
+import sys
+import time
+import argparse
+import importlib
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench import load_plugin_package, PLUGIN
+
+PAGE = '''<html><head><meta charset="utf-8"><title>x</title></head><body>
+<div id="work"><div><h1><span class="main-title">Pan Tadeusz</span></h1>
+<table>
+<tr><th>Autor:</th><td><div itemprop="creator">Mickiewicz Adam (autor)</div></td></tr>
+<tr><th>Wydawcy:</th><td>{publishers}</td></tr>
+<tr><th>ISBN:</th><td><span data-ipub-search="isbn">978-83-1</span></td></tr>
+</table></div></div>
+</body></html>'''
+
+
+def make_page(editions):
+    publishers = []
+    for i in range(editions):
+        first = 1834 + i % 190
+        years = '{}-{}'.format(first, first + i % 5) if i % 3 else str(first)
+        publishers.append('<div>Wydawnictwo {} ({})</div>'.format(i, years))
+    return PAGE.format(publishers=''.join(publishers)).encode('utf-8')
+
+
+# find_earliest_year before the fields module, kept as the reference
+def reference_years(texts):
+    years = []
+    for text in texts:
+        match = re.search(r"\(\d{4}\)|\(\d{4}-\d{4}\)", text)
+        if not match:
+            continue
+        match = match.group().strip("()")
+        years += [int(year) for year in match.split("-")] if '-' in match else [int(match)]
+    return (min(years), max(years), len(years)) if years else None
+
+
+def timed(func, iterations):
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times) * 1000
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Edition year extraction on pages with many editions')
+    ap.add_argument('--editions', default='10,100,500', help='comma separated edition counts')
+    ap.add_argument('--iterations', type=int, default=20)
+    args = ap.parse_args(argv)
+
+    load_plugin_package()
+    extractor = importlib.import_module(PLUGIN + '.extractor')
+    fields = importlib.import_module(PLUGIN + '.fields')
+    plan = extractor.FieldPlan(('publisher', 'pubdate'))
+
+    print('editions   parse ms   fields ms   reference ms   range')
+    for editions in [int(count) for count in args.editions.split(',')]:
+        page = make_page(editions)
+
+        def parse():
+            page_root = extractor.parse_page(io.BytesIO(page), plan.keep_ids, plan.keep_classes, plan.stop_after)
+            return [tag.text_content().strip() for tag in extractor.BookPage(page_root, plan).get_publishers()]
+
+        texts, parse_ms = timed(parse, args.iterations)
+        years, fields_ms = timed(lambda: fields.edition_years(texts), args.iterations)
+        reference, reference_ms = timed(lambda: reference_years(texts), args.iterations)
+        if years is None or years[:2] != reference[:2]:
+            print('edition years differ from the reference: {} != {}'.format(years, reference))
+            return 1
+        print('{:>8} {:>10.2f} {:>11.3f} {:>14.3f}   {}-{} ({} editions)'.format(
+            editions, parse_ms, fields_ms, reference_ms, years[0], years[1], years[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
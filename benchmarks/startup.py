@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Plugin load time and per call setup overhead.
+#
+#   calibre-debug -e benchmarks/startup.py
+#   calibre-debug -e benchmarks/startup.py -- --runs 20 --calls 5000
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench import load_plugin_package, BenchLog, PLUGIN
+
+# modules a headless identify job should not need before it actually runs
+WATCHED_MODULES = ('PyQt5', 'lxml.etree', PLUGIN + '.config', PLUGIN + '.parser', PLUGIN + '.network')
+
+
+# runs in a fresh interpreter, prints the load timings as json
+def child():
+    report = {}
+    start = time.perf_counter()
+    package = load_plugin_package()
+    report['plugin'] = time.perf_counter() - start
+    report['plugin_modules'] = [name for name in WATCHED_MODULES if name in sys.modules]
+
+    start = time.perf_counter()
+    package.Wbibliotece(None).prefs['max_results']
+    report['prefs'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    package.Wbibliotece.load('parser')
+    report['parser'] = time.perf_counter() - start
+    report['identify_modules'] = [name for name in WATCHED_MODULES if name in sys.modules]
+    print(json.dumps(report))
+
+
+def measure_load(python, runs):
+    reports = []
+    for _ in range(runs):
+        out = subprocess.run([python, os.path.abspath(__file__), '--child'], stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        reports.append(json.loads(out.strip().splitlines()[-1]))
+    return reports
+
+
+def measure_calls(calls):
+    package = load_plugin_package()
+    prefs_module = package.Wbibliotece.load('prefs')
+    parser_module = package.Wbibliotece.load('parser')
+    network_module = package.Wbibliotece.load('network')
+
+    class Plugin(package.Wbibliotece):
+        prefs = dict(prefs_module.prefs.defaults, cache=False, identifier_index=False)
+
+    plugin = Plugin(None)
+    log = BenchLog()
+    cases = (
+        ('Parser()', lambda: parser_module.Parser(plugin, log, 30)),
+        ('Parser.get_instance()', lambda: parser_module.Parser.get_instance(plugin, log, 30)),
+        ('Network()', lambda: network_module.Network(30, log, plugin.prefs)),
+        ('Network.get_instance()', lambda: network_module.Network.get_instance(30, log, plugin.prefs)),
+    )
+    results = []
+    for name, func in cases:
+        func()
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        results.append((name, (time.perf_counter() - start) / calls))
+    return results
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Plugin load time and per call setup overhead')
+    ap.add_argument('--runs', type=int, default=10, help='fresh interpreters for the load timings')
+    ap.add_argument('--calls', type=int, default=2000)
+    ap.add_argument('--python', default=sys.executable, help='interpreter for the load timings')
+    ap.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    reports = measure_load(args.python, args.runs)
+    print('stage            p50 ms     max ms')
+    for stage in ('plugin', 'prefs', 'parser'):
+        times = [report[stage] * 1000 for report in reports]
+        print('{:<12} {:>10.2f} {:>10.2f}'.format(stage, statistics.median(times), max(times)))
+    print('loaded with the plugin: ' + (', '.join(reports[0]['plugin_modules']) or '-'))
+    print('loaded for identify:    ' + (', '.join(reports[0]['identify_modules']) or '-'))
+
+    print('\nsetup                      us/call')
+    for name, seconds in measure_calls(args.calls):
+        print('{:<24} {:>10.1f}'.format(name, seconds * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import time
+import zlib
+
+from calibre_plugins.wbibliotece.storage import Store, guarded
+from calibre_plugins.wbibliotece.records import RecordCache
+from calibre_plugins.wbibliotece.covers import CoverStore, cover_cache
+
+CACHE_KINDS = ('search', 'book')
+
+
+class CacheEntry:
+    def __init__(self, url, kind, body, etag, last_modified, fetched, ttl):
+        self.url = url
+        self.kind = kind
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+        self.ttl = ttl
+
+    @property
+    def fresh(self):
+        return time.time() - self.fetched < self.ttl
+
+
+class ResponseCache(Store):
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+        CREATE TABLE IF NOT EXISTS responses_size (total INTEGER NOT NULL);
+        INSERT INTO responses_size SELECT COALESCE(SUM(size), 0) FROM responses
+            WHERE NOT EXISTS (SELECT 1 FROM responses_size);
+        CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+            UPDATE responses_size SET total = total + new.size;
+        END;
+        CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses BEGIN
+            UPDATE responses_size SET total = total + new.size - old.size;
+        END;
+        CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+            UPDATE responses_size SET total = total - old.size;
+        END;
+    '''
+    NAME = 'cache'
+    TABLE = 'responses'
+    KEY = 'url'
+    WEIGHT = 'size'
+    ttls = {}
+
+    @classmethod
+    def enabled(cls, prefs):
+        return prefs['cache']
+
+    def configure(self, prefs):
+        self.limit = prefs['cache_max_size'] * 1024 * 1024
+        self.ttls = {kind: prefs['cache_ttl_' + kind] * 3600 for kind in CACHE_KINDS}
+
+    # running total kept by the triggers, SUM(size) would read the overflow pages of every body
+    def weight(self, conn):
+        return conn.execute('SELECT total FROM responses_size').fetchone()[0]
+
+    def ttl(self, kind):
+        return self.ttls.get(kind, 0)
+
+    @guarded()
+    def get(self, url):
+        conn = self.connect()
+        row = conn.execute('SELECT kind, body, etag, last_modified, fetched FROM responses WHERE url = ?', (url,)).fetchone()
+        if not row:
+            return None
+        with conn:
+            conn.execute('UPDATE responses SET accessed = ? WHERE url = ?', (time.time(), url))
+        kind, body, etag, last_modified, fetched = row
+        return CacheEntry(url, kind, zlib.decompress(body), etag, last_modified, fetched, self.ttl(kind))
+
+    @guarded()
+    def put(self, url, kind, body, etag=None, last_modified=None):
+        if not self.ttl(kind):
+            return
+        data = zlib.compress(body)
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            # an upsert, REPLACE would delete the old row without running the size trigger
+            conn.execute('INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET '
+                         'kind = excluded.kind, body = excluded.body, size = excluded.size, etag = excluded.etag, '
+                         'last_modified = excluded.last_modified, fetched = excluded.fetched, accessed = excluded.accessed',
+                         (url, kind, data, len(data), etag, last_modified, now, now))
+        self.evict()
+
+    # called after a 304 Not Modified, the stored body is valid for another ttl
+    @guarded()
+    def refresh(self, url):
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute('UPDATE responses SET fetched = ?, accessed = ? WHERE url = ?', (now, now, url))
+
+# parsed book records and cover urls are cleared too, they would keep serving the old pages
+def clear_cache():
+    ResponseCache.get_store().clear()
+    RecordCache.get_store().clear()
+    CoverStore.get_store().clear()
+    cover_cache.clear()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Book descriptions as sanitized HTML. The summary subtree is walked once and written straight to
+# the output, only whitelisted tags without attributes are kept and the text is capped.
+import io
+import re
+from html import escape
+
+MAX_LENGTH = 10000
+ELLIPSIS = '…'
+
+ALLOWED_TAGS = frozenset(('p', 'br', 'b', 'strong', 'i', 'em', 'u', 'ul', 'ol', 'li', 'blockquote'))
+# block elements of the site markup become paragraphs
+RENAMED_TAGS = {'div': 'p', 'h1': 'p', 'h2': 'p', 'h3': 'p', 'h4': 'p', 'h5': 'p', 'h6': 'p'}
+# dropped with their content, everything else is unwrapped to its text
+DROPPED_TAGS = frozenset(('script', 'style', 'noscript', 'iframe', 'object', 'embed', 'form', 'button', 'img', 'svg', 'video', 'audio'))
+VOID_TAGS = frozenset(('br',))
+BLOCK_TAGS = frozenset(('p', 'ul', 'ol', 'li', 'blockquote'))
+# unwrapped blocks, their text is kept apart from the text around it by a line break
+BREAK_TAGS = frozenset(('p', 'section', 'article', 'table', 'tr', 'td', 'th', 'dl', 'dt', 'dd', 'pre', 'address', 'figure', 'hr'))
+
+WHITESPACE = re.compile(r'\s+')
+
+
+class CommentsWriter:
+    def __init__(self, max_length):
+        self.out = io.StringIO()
+        self.budget = max_length
+        self.open_tags = []
+        self.truncated = False
+        # text was written since the last block boundary, a break is due before the next text
+        self.line = False
+        self.pending_break = False
+
+    def separate(self):
+        if self.pending_break and self.line:
+            self.out.write('<br>')
+            self.line = False
+        self.pending_break = False
+
+    def text(self, text):
+        if not text or self.truncated:
+            return
+        text = WHITESPACE.sub(' ', text)
+        if text.strip():
+            self.separate()
+            self.line = True
+        if len(text) > self.budget:
+            # cut at a word boundary when there is one close by
+            cut = text.rfind(' ', 0, self.budget)
+            text = text[:cut if cut > self.budget // 2 else self.budget].rstrip() + ELLIPSIS
+            self.truncated = True
+        self.budget -= len(text)
+        self.out.write(escape(text, quote=False))
+
+    def start(self, tag):
+        if tag in BLOCK_TAGS or tag in VOID_TAGS:
+            self.line = self.pending_break = False
+        else:
+            self.separate()
+        self.out.write('<{}>'.format(tag))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def end(self, tag):
+        if tag in BLOCK_TAGS:
+            self.line = self.pending_break = False
+        if tag not in VOID_TAGS:
+            self.open_tags.pop()
+            self.out.write('</{}>'.format(tag))
+
+    def element(self, el):
+        # comments and processing instructions are dropped, their tail is text of the parent
+        if self.truncated or not isinstance(el.tag, str):
+            return
+        tag = el.tag.lower()
+        tag = RENAMED_TAGS.get(tag, tag)
+        if tag in DROPPED_TAGS:
+            return
+        breaks = False
+        # nested site blocks would give nested paragraphs
+        if tag not in ALLOWED_TAGS or (tag == 'p' and 'p' in self.open_tags):
+            breaks = tag in BREAK_TAGS
+            tag = None
+        if tag:
+            self.start(tag)
+        elif breaks:
+            self.pending_break = True
+        self.text(el.text)
+        for child in el:
+            self.element(child)
+            self.text(child.tail)
+        if tag:
+            self.end(tag)
+        elif breaks:
+            self.pending_break = True
+
+    def value(self):
+        while self.open_tags:
+            self.end(self.open_tags[-1])
+        return self.out.getvalue().strip()
+
+
+# the children of the summary element, the element itself is only a container
+def build_comments(element, max_length=MAX_LENGTH):
+    if element is None:
+        return None
+    writer = CommentsWriter(max_length)
+    writer.text(element.text)
+    for child in element:
+        writer.element(child)
+        writer.text(child.tail)
+    return writer.value() or None
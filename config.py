@@ -1,55 +1,18 @@
 #!/usr/bin/env python3
 from __future__ import (unicode_literals, division, absolute_import, print_function)
-from calibre.utils.config import JSONConfig
+import importlib
+
 from PyQt5.Qt import QWidget, QFormLayout, QVBoxLayout, QHBoxLayout, QGroupBox, \
-    QLabel, QLineEdit, QIntValidator, QDoubleValidator, QCheckBox, QTabWidget
+    QLabel, QLineEdit, QIntValidator, QDoubleValidator, QCheckBox, QTabWidget, QPushButton, QFileDialog, QMessageBox
 from PyQt5.QtWidgets import QSizePolicy
 
+from calibre_plugins.wbibliotece.prefs import IDENTIFIER, prefs, changed
+
 __license__ = 'MIT'
 __copyright__ = '2023 l4red0'
 __docformat__ = 'restructuredtext en'
 
 
-IDENTIFIER = 'wbibliotece'
-
-URL_SCHEME_TITLE = 'https://w.bibliotece.pl/search/?q=t%3A{title}'
-URL_SCHEME_TITLE_AUTHORS = 'https://w.bibliotece.pl/search/?q=o%3A{authors}+t%3A{title}'
-URL_SCHEME_ISBN = 'https://w.bibliotece.pl/search/?q=isbn%3A+{isbn}'
-
-AUTHORS_JOIN_DELIMETER = '+'
-AUTHORS_SPLIT_DELIMETER = '+'
-SKIP_AUTHORS = ('Unknown', 'Nieznany')
-
-prefs = JSONConfig('plugins/{}'.format(IDENTIFIER))
-
-prefs.defaults['max_results'] = 2
-prefs.defaults['authors_search'] = True
-prefs.defaults['only_first_author'] = False
-prefs.defaults['covers'] = True
-prefs.defaults['max_covers'] = 5
-prefs.defaults['threads'] = True
-prefs.defaults['max_threads'] = 3
-prefs.defaults['thread_delay'] = 0.1
-prefs.defaults['metamover'] = False
-
-# metadata settings
-prefs.defaults['title'] = True
-prefs.defaults['authors'] = True
-prefs.defaults['pubdate'] = True
-prefs.defaults['publisher'] = True
-prefs.defaults['series'] = True
-prefs.defaults['isbn'] = True
-prefs.defaults['comments'] = True
-prefs.defaults['languages'] = True
-prefs.defaults['rating'] = True
-prefs.defaults['tags'] = True
-prefs.defaults['identifier'] = True
-
-# additional metadata (metamover)
-#prefs.defaults['metamoverenabled'] = False
-#prefs.defaults['translators'] = False
-
-
 class ConfigWidget(QWidget):
     def __init__(self):
         QWidget.__init__(self)
@@ -140,6 +103,80 @@ pierwszy wynik może być niepoprawny')
         self.thread_delay_label.setBuddy(self.thread_delay)
         self.l0.addRow(self.thread_delay_label, self.thread_delay)
 
+        self.requests_per_second_label = QLabel('Maksymalna liczba zapytań na sekundę')
+        self.requests_per_second_label.setToolTip('Limit wspólny dla wszystkich wątków, zmniejszany automatycznie gdy serwer odpowiada wolniej lub z błędami')
+        self.requests_per_second = QLineEdit(self)
+        self.requests_per_second.setValidator(QDoubleValidator())
+        self.requests_per_second.setText(str(prefs['requests_per_second']))
+        self.requests_per_second_label.setBuddy(self.requests_per_second)
+        self.l0.addRow(self.requests_per_second_label, self.requests_per_second)
+
+        self.max_retries_label = QLabel('Liczba ponownych prób')
+        self.max_retries_label.setToolTip('Ponawianie zapytań po przekroczeniu czasu lub błędzie serwera (429, 5xx)')
+        self.max_retries = QLineEdit(self)
+        self.max_retries.setValidator(QIntValidator())
+        self.max_retries.setText(str(prefs['max_retries']))
+        self.max_retries_label.setBuddy(self.max_retries)
+        self.l0.addRow(self.max_retries_label, self.max_retries)
+
+        self.cache_label = QLabel('Pamięć podręczna')
+        self.cache_label.setToolTip('Zapisuje pobrane strony na dysku, ponowne wyszukiwania nie wymagają połączenia z serwerem')
+        self.cache = QCheckBox()
+        self.cache.setChecked(prefs['cache'])
+        self.cache_label.setBuddy(self.cache)
+        self.l0.addRow(self.cache_label, self.cache)
+
+        self.cache_max_size_label = QLabel('Rozmiar pamięci podręcznej (MB)')
+        self.cache_max_size = QLineEdit(self)
+        self.cache_max_size.setValidator(QIntValidator())
+        self.cache_max_size.setText(str(prefs['cache_max_size']))
+        self.cache_max_size_label.setBuddy(self.cache_max_size)
+        self.l0.addRow(self.cache_max_size_label, self.cache_max_size)
+
+        self.cache_ttl_search_label = QLabel('Ważność wyników wyszukiwania (godziny)')
+        self.cache_ttl_search = QLineEdit(self)
+        self.cache_ttl_search.setValidator(QIntValidator())
+        self.cache_ttl_search.setText(str(prefs['cache_ttl_search']))
+        self.cache_ttl_search_label.setBuddy(self.cache_ttl_search)
+        self.l0.addRow(self.cache_ttl_search_label, self.cache_ttl_search)
+
+        self.cache_ttl_book_label = QLabel('Ważność stron książek (godziny)')
+        self.cache_ttl_book = QLineEdit(self)
+        self.cache_ttl_book.setValidator(QIntValidator())
+        self.cache_ttl_book.setText(str(prefs['cache_ttl_book']))
+        self.cache_ttl_book_label.setBuddy(self.cache_ttl_book)
+        self.l0.addRow(self.cache_ttl_book_label, self.cache_ttl_book)
+
+        self.clear_cache = QPushButton('Wyczyść pamięć podręczną')
+        self.clear_cache.clicked.connect(self.on_clear_cache)
+        self.l0.addRow(self.clear_cache)
+
+        self.identifier_index_label = QLabel('Indeks identyfikatorów')
+        self.identifier_index_label.setToolTip('Zapamiętuje znalezione książki (ISBN, tytuł i autorzy), kolejne wyszukiwania pomijają stronę wyników')
+        self.identifier_index = QCheckBox()
+        self.identifier_index.setChecked(prefs['identifier_index'])
+        self.identifier_index_label.setBuddy(self.identifier_index)
+        self.l0.addRow(self.identifier_index_label, self.identifier_index)
+
+        index_buttons = QHBoxLayout()
+        self.export_index = QPushButton('Eksportuj indeks')
+        self.export_index.clicked.connect(self.on_export_index)
+        index_buttons.addWidget(self.export_index)
+        self.import_index = QPushButton('Importuj indeks')
+        self.import_index.clicked.connect(self.on_import_index)
+        index_buttons.addWidget(self.import_index)
+        self.clear_index = QPushButton('Wyczyść indeks')
+        self.clear_index.clicked.connect(self.on_clear_index)
+        index_buttons.addWidget(self.clear_index)
+        self.l0.addRow(index_buttons)
+
+        self.stats_file_label = QLabel('Plik statystyk (JSON)')
+        self.stats_file_label.setToolTip('Zbiorcze liczniki i czasy pobierania zapisywane po każdym wyszukiwaniu, każdy proces calibre zapisuje osobny plik z numerem PID w nazwie (stats.1234.json), puste pole wyłącza zapis')
+        self.stats_file = QLineEdit(self)
+        self.stats_file.setText(prefs['stats_file'])
+        self.stats_file_label.setBuddy(self.stats_file)
+        self.l0.addRow(self.stats_file_label, self.stats_file)
+
      # metadata settings
         self.title = QCheckBox('Tytuł')
         self.title.setChecked(prefs['title'])
@@ -185,18 +222,55 @@ pierwszy wynik może być niepoprawny')
         self.identifier.setChecked(prefs['identifier'])
         self.l2.addWidget(self.identifier)
 
-        #self.identifier = QCheckBox('Enable metaMOVER')
-        #self.identifier.setChecked(prefs['metamoverenabled'])
-        #self.l2.addWidget(self.metamoverenabled)
+        self.metamoverenabled = QCheckBox('Dodatkowe informacje w opisie (metaMOVER)')
+        self.metamoverenabled.setToolTip('Dopisuje do opisu wybrane poniżej pola ze szczegółów książki')
+        self.metamoverenabled.setChecked(prefs['metamoverenabled'])
+        self.l2.addWidget(self.metamoverenabled)
 
-        #self.identifier = QCheckBox('Tłumacze')
-        #self.identifier.setChecked(prefs['translators'])
-        #self.l2.addWidget(self.translators)
+        self.translators = QCheckBox('Tłumacze')
+        self.translators.setChecked(prefs['translators'])
+        self.l2.addWidget(self.translators)
+
+        self.illustrators = QCheckBox('Ilustratorzy')
+        self.illustrators.setChecked(prefs['illustrators'])
+        self.l2.addWidget(self.illustrators)
+
+        self.original_title = QCheckBox('Tytuł oryginału')
+        self.original_title.setChecked(prefs['original_title'])
+        self.l2.addWidget(self.original_title)
 
         self.group_box.setLayout(self.l0)
         self.group_box2.setLayout(self.l2)
         self.setLayout(self.main_layout)
 
+    def on_clear_cache(self):
+        cache_module = importlib.import_module('calibre_plugins.{}.cache'.format(IDENTIFIER))
+        cache_module.clear_cache()
+
+    def on_export_index(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Eksportuj indeks', IDENTIFIER + '-index.json', 'JSON (*.json)')
+        if not path:
+            return
+        index_module = importlib.import_module('calibre_plugins.{}.index'.format(IDENTIFIER))
+        count = index_module.get_index().export(path)
+        QMessageBox.information(self, 'Eksportuj indeks', 'Zapisano wpisów: {}'.format(count))
+
+    def on_import_index(self):
+        path, _ = QFileDialog.getOpenFileName(self, 'Importuj indeks', '', 'JSON (*.json)')
+        if not path:
+            return
+        index_module = importlib.import_module('calibre_plugins.{}.index'.format(IDENTIFIER))
+        try:
+            count = index_module.get_index().import_(path)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, 'Importuj indeks', 'Nie udało się wczytać indeksu: {}'.format(e))
+            return
+        QMessageBox.information(self, 'Importuj indeks', 'Wczytano wpisów: {}'.format(count))
+
+    def on_clear_index(self):
+        index_module = importlib.import_module('calibre_plugins.{}.index'.format(IDENTIFIER))
+        index_module.get_index().clear()
+
     def save_settings(self):
         prefs['max_results'] = int(self.max_results.text())
         prefs['authors_search'] = self.authors_search.isChecked()
@@ -206,6 +280,14 @@ pierwszy wynik może być niepoprawny')
         prefs['threads'] = self.threads.isChecked()
         prefs['max_threads'] = int(self.max_threads.text())
         prefs['thread_delay'] = float(self.thread_delay.text().replace(',', '.'))
+        prefs['requests_per_second'] = float(self.requests_per_second.text().replace(',', '.'))
+        prefs['max_retries'] = int(self.max_retries.text())
+        prefs['cache'] = self.cache.isChecked()
+        prefs['cache_max_size'] = int(self.cache_max_size.text())
+        prefs['cache_ttl_search'] = int(self.cache_ttl_search.text())
+        prefs['cache_ttl_book'] = int(self.cache_ttl_book.text())
+        prefs['identifier_index'] = self.identifier_index.isChecked()
+        prefs['stats_file'] = self.stats_file.text().strip()
 
         # metadata settings
         prefs['title'] = self.title.isChecked()
@@ -221,7 +303,10 @@ pierwszy wynik może być niepoprawny')
         prefs['identifier'] = self.identifier.isChecked()
 
         # extended metadata (METAmove)
-        #prefs['metamoverenabled'] = self.metamoverenabled.isChecked()
-        #prefs['translators'] = self.translators.isChecked()
+        prefs['metamoverenabled'] = self.metamoverenabled.isChecked()
+        prefs['translators'] = self.translators.isChecked()
+        prefs['illustrators'] = self.illustrators.isChecked()
+        prefs['original_title'] = self.original_title.isChecked()
 
+        changed()
         return prefs
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from calibre_plugins.wbibliotece.storage import Store, guarded
+
+MAX_ENTRIES = 4096
+MAX_STORED = 50000
+
+
+def cover_keys(identifiers):
+    keys = []
+    book_id = identifiers.get('wbibliotece', None)
+    if book_id:
+        keys.append('wbibliotece:' + str(book_id))
+    isbn = identifiers.get('isbn', None)
+    if isbn:
+        keys.append('isbn:' + isbn.replace('-', '').strip().upper())
+    return keys
+
+
+# cover urls on disk, shared by the worker processes calibre starts for a bulk download
+class CoverStore(Store):
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS covers (
+            key TEXT PRIMARY KEY,
+            urls TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS covers_updated ON covers (updated);
+    '''
+    NAME = 'covers'
+    TABLE = 'covers'
+    KEY = 'key'
+    ORDER = 'updated'
+    limit = MAX_STORED
+    ttl = 0
+
+    # urls come from book pages, they follow the cache switch and the book page ttl
+    @classmethod
+    def enabled(cls, prefs):
+        return prefs['cache'] and prefs['cache_ttl_book']
+
+    def configure(self, prefs):
+        self.ttl = prefs['cache_ttl_book'] * 3600
+
+    @guarded()
+    def get(self, keys):
+        conn = self.connect()
+        for key in keys:
+            row = conn.execute('SELECT urls, updated FROM covers WHERE key = ?', (key,)).fetchone()
+            if row and time.time() - row[1] <= self.ttl:
+                try:
+                    return tuple(json.loads(row[0]))
+                except ValueError:
+                    return None
+        return None
+
+    @guarded()
+    def put(self, keys, urls):
+        data = json.dumps(urls, ensure_ascii=False)
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO covers VALUES (?, ?, ?)', [(key, data, now) for key in keys])
+        self.evict()
+
+
+# cover urls of parsed books, keyed by book id and ISBN, least recently used entries are dropped.
+# Misses fall back to the shared store when one is given, books identified by another worker
+# process are then known here too.
+class CoverCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, identifiers, store=None):
+        keys = cover_keys(identifiers)
+        with self.lock:
+            for key in keys:
+                urls = self.entries.get(key)
+                if urls is not None:
+                    self.entries.move_to_end(key)
+                    return list(urls)
+        if store is None or not keys:
+            return None
+        urls = store.get(keys)
+        if urls is None:
+            return None
+        self.remember(keys, urls)
+        return list(urls)
+
+    def put(self, identifiers, urls, store=None):
+        keys = cover_keys(identifiers)
+        urls = tuple(urls)
+        self.remember(keys, urls)
+        if store is not None and keys:
+            store.put(keys, urls)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def remember(self, keys, urls):
+        with self.lock:
+            for key in keys:
+                self.entries[key] = urls
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+cover_cache = CoverCache()
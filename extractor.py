@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import lxml.etree
+import lxml.html
+
+METADATA_FIELDS = ('title', 'authors', 'pubdate', 'publisher', 'series', 'isbn', 'comments', 'languages', 'rating', 'tags', 'identifier')
+DETAILS_FIELDS = frozenset(('authors', 'pubdate', 'publisher', 'series', 'isbn', 'comments', 'rating', 'tags'))
+CHUNK_SIZE = 16 * 1024
+
+WORK = lxml.etree.XPath('//*[@id="work"]')
+WORK_TITLE = lxml.etree.XPath('.//h1/span[@class="main-title"]')
+WORK_COVERS = lxml.etree.XPath('.//div[@id="covers"]//following-sibling::div[@class="box"]//a/@href')
+SUMMARY_PREVIEW = lxml.etree.XPath('.//div[contains(@class, "summary-preview")]')
+DETAILS_PUBLISHERS = lxml.etree.XPath('//table[@id="details"]//tr//th[starts-with(text(),"Wydawc")]//following-sibling::td/span[normalize-space(text())]')
+TAGS = lxml.etree.XPath('//a[@class="tag"]/text()')
+GENRES = lxml.etree.XPath('//*[@class="spreadme-product"]/span[starts-with(text(),"Gatunek:")]/following-sibling::span')
+
+LABEL_SERIES = 'Wydane w seriach:'
+LABEL_PUBLISHERS = 'Wydawc'
+LABEL_PUBDATE = 'Wyd. w latach:'
+
+
+class FieldPlan:
+    def __init__(self, fields, covers=False):
+        self.fields = frozenset(fields)
+        self.covers = covers
+        self.details = bool(self.fields & DETAILS_FIELDS)
+        self.series = bool(self.fields & {'series', 'tags'})
+        self.publishers = bool(self.fields & {'publisher', 'pubdate'})
+        # tags and genres are spread over the whole page, other fields are in #work
+        # and the publishers details table, parsing can stop once those are complete
+        self.keep_ids = frozenset(('work', 'details')) if self.publishers else frozenset(('work',))
+        self.keep_classes = frozenset(('tag', 'spreadme-product')) if 'tags' in self.fields else frozenset()
+        self.stop_after = None if self.keep_classes else self.keep_ids
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    @classmethod
+    def from_prefs(cls, prefs):
+        return cls([field for field in METADATA_FIELDS if prefs[field]], prefs['covers'])
+
+
+# Incremental parse of the response stream. Only the subtrees with an id from
+# keep_ids or a class from keep_classes are built, everything else (navigation,
+# scripts, footer) is cleared as soon as it is closed.
+def parse_page(stream, keep_ids, keep_classes=frozenset(), stop_after=None):
+    parser = lxml.etree.HTMLPullParser(events=('start', 'end'))
+    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+    pending = set(stop_after or ())
+    keep_ancestors = set()
+    depth = 0
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        parser.feed(data)
+        for event, el in parser.read_events():
+            if event == 'start':
+                if depth or el.get('id') in keep_ids or el.get('class') in keep_classes:
+                    depth += 1
+            elif depth:
+                depth -= 1
+                if not depth:
+                    keep_ancestors.update(el.iterancestors())
+                    pending.discard(el.get('id'))
+            elif el not in keep_ancestors:
+                el.clear()
+        if stop_after and not pending:
+            break
+    return parser.close()
+
+
+class BookPage:
+    def __init__(self, root, plan=None):
+        self.root = root
+        self.queries = 1
+        work = WORK(root)
+        self.work = work[0] if work else None
+        self.cells = {}
+        self.summary = None
+        self.creator = None
+        self.rating = None
+        self.isbn = None
+        if self.work is not None and (plan is None or plan.details):
+            self.read_details()
+
+    # single walk over the #work tables, collects labelled rows and the microdata fields
+    def read_details(self):
+        for table in self.work.iter('table'):
+            for el in table.iter('tr', 'div', 'span'):
+                if el.tag == 'tr':
+                    if el.get('class') == 'summary':
+                        self.summary = el
+                    th = el.find('th')
+                    td = el.find('td')
+                    if th is not None and td is not None:
+                        self.cells.setdefault((th.text or '').strip(), td)
+                elif el.get('itemprop') == 'creator':
+                    if self.creator is None:
+                        self.creator = el
+                elif el.get('itemprop') == 'ratingValue':
+                    if self.rating is None:
+                        self.rating = el
+                elif el.get('data-ipub-search') == 'isbn':
+                    if self.isbn is None:
+                        self.isbn = el
+
+    def cell(self, label):
+        for key, td in self.cells.items():
+            if key.startswith(label):
+                return td
+        return None
+
+    def get_title(self):
+        if self.work is None:
+            return None
+        self.queries += 1
+        tag = WORK_TITLE(self.work)
+        return tag[0].text_content().strip() if tag else None
+
+    def get_authors(self):
+        if self.creator is None:
+            return None
+        return self.creator.text_content().partition('(')[0].strip()
+
+    def get_publishers(self):
+        td = self.cell(LABEL_PUBLISHERS)
+        publishers = list(td.iter('div')) if td is not None else []
+        if publishers:
+            return publishers
+        # publishers are listed in the separate details table on some pages
+        self.queries += 1
+        return DETAILS_PUBLISHERS(self.root)
+
+    def get_pubdate(self):
+        td = self.cell(LABEL_PUBDATE)
+        return td.text_content().strip() if td is not None else None
+
+    def get_series(self):
+        td = self.cell(LABEL_SERIES)
+        if td is None:
+            return []
+        return [span.text_content().strip() for span in td.iter('span')]
+
+    def get_comments(self):
+        if self.summary is None:
+            return None
+        self.queries += 1
+        tag = SUMMARY_PREVIEW(self.summary)
+        return tag[0] if tag else None
+
+    def get_rating(self):
+        return self.rating.text_content().strip() if self.rating is not None else None
+
+    def get_isbn(self):
+        return self.isbn.text_content().strip() if self.isbn is not None else None
+
+    def get_tags(self):
+        self.queries += 1
+        return TAGS(self.root)
+
+    def get_genres(self):
+        self.queries += 1
+        return [span.text_content().strip() for span in GENRES(self.root)]
+
+    def get_covers(self):
+        if self.work is None:
+            return []
+        self.queries += 1
+        return ['https:' + href for href in WORK_COVERS(self.work) if href]
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Parsing of book page field text. Patterns are compiled once, every function returns None
+# instead of raising when the page does not have the expected format.
+import re
+
+YEAR = re.compile(r'\b(\d{4})\b')
+# "Znak (2001)" or "Iskry (1999-2003)"
+EDITION_YEARS = re.compile(r'\((\d{4})(?:\s*-\s*(\d{4}))?\)')
+PARENTHESES = re.compile(r'\s*\([^)]*\)')
+WHITESPACE = re.compile(r'\s+')
+NUMBER = re.compile(r'\d+(?:[.,]\d+)?')
+BOOK_ID = re.compile(r'\b(\d+)\b')
+
+MIN_YEAR = 1000
+MAX_YEAR = 9999
+
+
+def parse_year(text):
+    match = YEAR.search(text or '')
+    if not match:
+        return None
+    year = int(match.group(1))
+    return year if MIN_YEAR <= year <= MAX_YEAR else None
+
+
+# (first, latest, count) of the edition years in the publisher entries, count is the number of
+# entries with years, None when there are none
+def edition_years(publishers):
+    editions = EDITION_YEARS.findall('\n'.join(publishers))
+    years = [int(year) for edition in editions for year in edition if year]
+    years = [year for year in years if MIN_YEAR <= year <= MAX_YEAR]
+    return (min(years), max(years), len(editions)) if years else None
+
+
+# publisher name without the edition years
+def clean_publisher(text):
+    text = WHITESPACE.sub(' ', PARENTHESES.sub('', text or '')).strip()
+    return text or None
+
+
+def parse_rating(text):
+    match = NUMBER.search(text or '')
+    return float(match.group().replace(',', '.')) if match else None
+
+
+def book_id(url):
+    match = BOOK_ID.search(url or '')
+    return match.group(1) if match else None
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import json
+import time
+
+from calibre_plugins.wbibliotece.storage import Store, guarded
+from calibre_plugins.wbibliotece.normalize import normalize_text, authors_tokens
+
+EXPORT_FORMAT = 'wbibliotece-index'
+EXPORT_VERSION = 1
+
+
+def isbn_key(isbn):
+    return 'isbn:' + isbn.replace('-', '').strip().upper()
+
+
+def title_key(title, authors):
+    title = normalize_text(title)
+    if not title:
+        return None
+    # author order and first/last name order differ between calibre and the site
+    return 'title:{}|{}'.format(title, ' '.join(sorted(authors_tokens(authors))))
+
+
+class IdentifierIndex(Store):
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS books (
+            key TEXT PRIMARY KEY,
+            book_id TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS books_book_id ON books (book_id);
+    '''
+    NAME = 'index'
+    TABLE = 'books'
+    KEY = 'key'
+
+    @classmethod
+    def enabled(cls, prefs):
+        return prefs['identifier_index']
+
+    def keys(self, title=None, authors=None, isbn=None):
+        keys = []
+        if isbn:
+            keys.append(isbn_key(isbn))
+        if title:
+            key = title_key(title, authors)
+            if key:
+                keys.append(key)
+        return keys
+
+    @guarded()
+    def lookup(self, title=None, authors=None, isbn=None):
+        conn = self.connect()
+        for key in self.keys(title, authors, isbn):
+            row = conn.execute('SELECT book_id FROM books WHERE key = ?', (key,)).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    # title and authors have to come from the book page, a title key stays with the book it
+    # was first added for, several books can share a title
+    @guarded()
+    def add(self, book_id, title=None, authors=None, isbn=None):
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            if isbn:
+                conn.execute('INSERT OR REPLACE INTO books VALUES (?, ?, ?)', (isbn_key(isbn), book_id, now))
+            key = title_key(title, authors) if title else None
+            if key:
+                conn.execute('INSERT OR IGNORE INTO books VALUES (?, ?, ?)', (key, book_id, now))
+
+    @guarded()
+    def invalidate(self, book_id):
+        conn = self.connect()
+        with conn:
+            conn.execute('DELETE FROM books WHERE book_id = ?', (book_id,))
+
+    def export(self, path):
+        rows = self.connect().execute('SELECT key, book_id FROM books ORDER BY key').fetchall()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'format': EXPORT_FORMAT, 'version': EXPORT_VERSION, 'entries': rows}, f, ensure_ascii=False, indent=0)
+        return len(rows)
+
+    def import_(self, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != EXPORT_FORMAT or data.get('version') != EXPORT_VERSION:
+            raise ValueError('Unsupported index file: ' + path)
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO books VALUES (?, ?, ?)',
+                             [(key, str(book_id), now) for key, book_id in data['entries']])
+        return len(data['entries'])
+
+
+def get_index():
+    return IdentifierIndex.get_store()
@@ -1,18 +1,44 @@
 import re
+from html import escape
 
+# (pref, details table label prefix, heading in the description)
+SECTIONS = (
+    ('translators', 'Tłumacz', 'Tłumaczenie'),
+    ('illustrators', 'Ilustr', 'Ilustracje'),
+    ('original_title', 'Tytuł oryg', 'Tytuł oryginału'),
+)
 
-class Metamover:
-    def __init__(self, log):
-        self.log = log
+# "Jan Kowalski (tłumacz), Anna Nowak"
+SEPARATORS = re.compile(r'\s*[,;\n]\s*')
+ROLES = re.compile(r'\s*\([^)]*\)')
 
-    @property
-    def prefs(self):
-        return self.plugin.prefs
 
-    def formatMetaMoverComment(root):
-        self.parseMetaTranslators(root)
+class Metamover:
+    def __init__(self, log=None):
+        self.log = log
 
-        return "dsds"
+    # values of every section found on the page, kept whatever the prefs so a cached record
+    # can be shown with other settings
+    def parseMetaSections(self, page):
+        sections = {}
+        for name, label, heading in SECTIONS:
+            td = page.cell(label)
+            if td is None:
+                continue
+            if name == 'original_title':
+                values = [ROLES.sub('', td.text_content()).strip()]
+            else:
+                values = [ROLES.sub('', value).strip() for value in SEPARATORS.split(td.text_content())]
+            values = [value for value in values if value]
+            if values:
+                sections[name] = values
+        return sections
 
-    def parseMetaTranslators(root):
-        pass
+    # blocks appended to the description for the sections enabled in prefs
+    def formatMetaMoverComment(self, sections, prefs):
+        blocks = []
+        for name, label, heading in SECTIONS:
+            values = sections.get(name)
+            if values and prefs[name]:
+                blocks.append('<p><b>{}:</b> {}</p>'.format(heading, escape(', '.join(values), quote=False)))
+        return ''.join(blocks)
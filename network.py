@@ -1,28 +1,336 @@
 #!/usr/bin/env python3
+import io
+import gzip
+import time
+import socket
+import threading
+import http.client
 import http.cookiejar
+import urllib.parse
 import urllib.request
-import urllib.error
+
+from calibre_plugins.wbibliotece import prefs as settings
+from calibre_plugins.wbibliotece.cache import ResponseCache
+from calibre_plugins.wbibliotece.stats import Stats
+from calibre_plugins.wbibliotece.scheduler import Scheduler, Aborted, RETRY_CODES, THROTTLE_CODES
+
+USER_AGENT = 'Mozilla/5.0 (compatible; calibre-plugin-wbibliotece)'
+MAX_REDIRECTS = 5
+MAX_IDLE_CONNECTIONS = 8
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PROBE_SIZE = 16 * 1024
+DISCONNECT_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class ConnectionPool:
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, scheme, host, port, timeout):
+        key = (scheme, host, port)
+        with self.lock:
+            conns = self.idle.get(key)
+            conn = conns.pop() if conns else None
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            return conn_class(host, port, timeout=timeout), False
+        conn.timeout = timeout
+        if conn.sock:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def put(self, scheme, host, port, conn):
+        with self.lock:
+            conns = self.idle.setdefault((scheme, host, port), [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.aborted = False
+
+
+# concurrent calls with the same key share the result of the first one
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    # returns (result, shared), shared is True when another thread did the work
+    def do(self, key, func, *args, abort=None):
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self.calls[key] = Call()
+            if leader:
+                break
+
+            while not call.event.wait(0.1):
+                if abort is not None and abort.is_set():
+                    return None, True
+            # a leader stopped by its own abort has no result, run the call again
+            if not call.aborted:
+                return call.result, True
+
+        try:
+            call.result = func(*args)
+        finally:
+            call.aborted = abort is not None and abort.is_set()
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result, False
+
+
+# a pooled keep-alive connection the server closed in the meantime
+class StaleConnection(ConnectionError):
+    pass
+
+
+# a partially read body leaves the connection unusable
+def reusable(resp):
+    return not resp.will_close and resp.isclosed()
+
+
+# shared by every Network instance in the process, so keep-alive connections
+# and session cookies survive between identify and download_cover calls
+pool = ConnectionPool()
+cookie_jar = http.cookiejar.CookieJar()
+downloads = SingleFlight()
+
 
 class Network:
-    def __init__(self, timeout, log):
+    instances = {}
+    instances_lock = threading.Lock()
+
+    def __init__(self, timeout, log, prefs, stats=None, abort=None):
         self.timeout = timeout
         self.log = log
-        self.cj = http.cookiejar.CookieJar()
-        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cj))
-        urllib.request.install_opener(self.opener)
+        self.abort = abort
+        self.stats = stats if stats is not None else Stats()
+        self.cache = ResponseCache.get_instance(prefs)
+        self.scheduler = Scheduler.get_instance(prefs)
+        self.cj = cookie_jar
+        self.generation = settings.generation
 
+    # one Network per class for the whole process, every job gets a bound copy of it
+    @classmethod
+    def get_instance(cls, timeout, log, prefs, stats=None, abort=None):
+        with cls.instances_lock:
+            network = cls.instances.get(cls)
+            if network is None or network.generation != settings.generation:
+                network = cls.instances[cls] = cls(timeout, log, prefs)
+        return network.bind(timeout, log, stats, abort)
 
-    def download_page(self, url: str):
+    # the connection pool, cookies, cache and scheduler stay shared
+    def bind(self, timeout, log, stats=None, abort=None):
+        network = object.__new__(type(self))
+        network.__dict__.update(self.__dict__)
+        network.timeout = timeout
+        network.log = log
+        network.abort = abort
+        network.stats = stats if stats is not None else Stats()
+        return network
+
+    # replaces socket.create_connection in http.client to time name resolution separately
+    def create_connection(self, address, timeout, source_address=None):
+        host, port = address
+        start = time.perf_counter()
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        self.stats.add_time('dns', time.perf_counter() - start)
+        error = None
+        for family, socktype, proto, canonname, sockaddr in addresses:
+            try:
+                return socket.create_connection(sockaddr[:2], timeout, source_address)
+            except OSError as e:
+                error = e
+        raise error or OSError('No address found for ' + host)
+
+    def connect(self, conn):
+        conn._create_connection = self.create_connection
+        start = time.perf_counter()
+        conn.connect()
+        self.stats.add('connections')
+        self.stats.add_time('connect', time.perf_counter() - start)
+
+    # sends the request on a pooled connection
+    def exchange(self, parts, path, headers, read_limit=None):
+        conn, reused = pool.get(parts.scheme, parts.hostname, parts.port, self.timeout)
         try:
-            resp = urllib.request.urlopen(url, timeout=self.timeout)
-            self.log.info('INFO: Download complete: ' + url)
-            return resp
-        except urllib.error.URLError as e:
-            self.log.error('ERROR: Download failded: ' + url)
-            self.log.exception(e)
-            return
-        except socket.timeout as e:
-            self.log.exception(e)
+            if conn.sock is None:
+                self.connect(conn)
+            else:
+                self.stats.add('connections_reused')
+            with self.stats.timer('transfer'):
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read(read_limit) if read_limit else resp.read()
+        except Exception as e:
+            conn.close()
+            if reused and isinstance(e, DISCONNECT_ERRORS):
+                raise StaleConnection(str(e)) from e
+            raise
+
+        if reusable(resp):
+            pool.put(parts.scheme, parts.hostname, parts.port, conn)
+        else:
+            conn.close()
+        return resp, body
+
+    def send(self, req, read_limit=None):
+        parts = urllib.parse.urlsplit(req.full_url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(req.header_items())
+
+        try:
+            resp, body = self.exchange(parts, path, headers, read_limit)
+        except StaleConnection:
+            # server dropped an idle keep-alive connection, retry once on a fresh one
+            resp, body = self.exchange(parts, path, headers, read_limit)
+        self.stats.add('requests')
+        self.stats.add('bytes', len(body))
+        if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        return resp, body
+
+    def request(self, url, headers=None, read_limit=None):
+        for _ in range(MAX_REDIRECTS + 1):
+            req = urllib.request.Request(url, headers=headers or {})
+            req.add_header('User-Agent', USER_AGENT)
+            if not req.has_header('Accept-encoding'):
+                req.add_header('Accept-Encoding', 'gzip')
+            self.cj.add_cookie_header(req)
+            resp, body = self.send(req, read_limit)
+            self.cj.extract_cookies(resp, req)
+            location = resp.getheader('Location')
+            if resp.status in REDIRECT_CODES and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return resp, body
+        raise http.client.HTTPException('Too many redirects')
+
+    def wait(self, delay):
+        if self.abort is not None:
+            return self.abort.wait(delay)
+        time.sleep(delay)
+        return False
+
+    # request through the shared scheduler, retrying throttled, failed and timed out requests
+    def fetch(self, url, headers=None, read_limit=None):
+        resp = error = None
+        max_retries = self.scheduler.max_retries
+        for attempt in range(max_retries + 1):
+            if attempt:
+                delay = self.scheduler.backoff(attempt - 1, resp.getheader('Retry-After') if resp is not None else None)
+                self.log.warn('WARN: Retrying in {:.1f}s ({}/{}): {}'.format(delay, attempt, max_retries, url))
+                self.stats.add('retries')
+                if self.wait(delay):
+                    return None
+
+            resp = error = None
+            start = time.perf_counter()
+            try:
+                with self.scheduler.slot(self.abort):
+                    self.stats.add_time('wait', time.perf_counter() - start)
+                    start = time.perf_counter()
+                    try:
+                        resp, body = self.request(url, headers, read_limit)
+                    except (OSError, http.client.HTTPException) as e:
+                        error = e
+            except Aborted:
+                return None
+            self.scheduler.record(time.perf_counter() - start, resp.status if resp is not None else None)
+
+            if resp is not None and resp.status not in RETRY_CODES:
+                return resp, body
+            if resp is not None and resp.status in THROTTLE_CODES:
+                self.stats.add('throttled')
+
+        self.stats.add('errors')
+        if isinstance(error, socket.timeout):
+            self.log.exception(error)
             self.log.error(
                 'ERROR: Download failded, request timed out: ' + url)
+        elif error is not None:
+            self.log.error('ERROR: Download failded: ' + url)
+            self.log.exception(error)
+        else:
+            self.log.error('ERROR: Download failded: {} (HTTP {} {})'.format(url, resp.status, resp.reason))
+        return None
+
+    def download_page(self, url: str, kind=None):
+        body, shared = downloads.do(url, self.download, url, kind, abort=self.abort)
+        if shared:
+            self.log.info('INFO: Joined download in progress: ' + url)
+            self.stats.add('coalesced')
+        return io.BytesIO(body) if body is not None else None
+
+    def download(self, url, kind=None):
+        entry = None
+        headers = {}
+        if self.cache and kind:
+            entry = self.cache.get(url)
+            if entry and entry.fresh:
+                self.log.info('INFO: Cache hit: ' + url)
+                self.stats.add('cache_hits')
+                return entry.body
+            self.stats.add('cache_misses')
+            # stale entry, ask the server whether it changed
+            if entry and entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry and entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        result = self.fetch(url, headers)
+        if result is None:
+            return
+        resp, body = result
+
+        if resp.status == 304 and entry:
+            self.log.info('INFO: Cache revalidated: ' + url)
+            self.stats.add('cache_revalidated')
+            self.cache.refresh(url)
+            return entry.body
+        if resp.status >= 300:
+            self.stats.add('errors')
+            self.log.error('ERROR: Download failded: {} (HTTP {} {})'.format(url, resp.status, resp.reason))
             return
+
+        self.log.info('INFO: Download complete: ' + url)
+        if self.cache and kind:
+            self.cache.put(url, kind, body, resp.getheader('ETag'), resp.getheader('Last-Modified'))
+        return body
+
+    # first bytes of a resource and its full size, enough to read an image header
+    def probe(self, url, length=PROBE_SIZE):
+        result = self.fetch(url, {'Range': 'bytes=0-{}'.format(length - 1), 'Accept-Encoding': 'identity'}, length)
+        if result is None:
+            return None
+        resp, body = result
+        if resp.status == 206:
+            size = resp.getheader('Content-Range', '').rpartition('/')[2]
+        elif resp.status == 200:
+            size = resp.getheader('Content-Length', '')
+        else:
+            self.log.warn('WARN: Probe failed: {} (HTTP {} {})'.format(url, resp.status, resp.reason))
+            return None
+        self.stats.add('probes')
+        return body, int(size) if size.isdigit() else None
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Title and author normalization shared by search matching, the identifier index and batch identify.
+# Results are memoized, the same names and titles come back for every search result and every book.
+import unicodedata
+from functools import lru_cache
+
+CACHE_SIZE = 16384
+
+# letters without a unicode decomposition
+FOLD_TABLE = str.maketrans({'ł': 'l', 'Ł': 'L', 'ø': 'o', 'Ø': 'O', 'đ': 'd', 'Đ': 'D', 'ß': 'ss'})
+
+# compared after folding, so "się" is "sie"
+TITLE_STOP_WORDS = frozenset((
+    'na', 'do', 'od', 'po', 'ze', 'we', 'za', 'dla', 'oraz', 'lub', 'albo', 'czyli', 'jak', 'sie', 'to',
+    'the', 'of', 'and',
+))
+# roles and name particles, written differently by calibre and the site
+AUTHOR_STOP_WORDS = frozenset((
+    'autor', 'red', 'redaktor', 'redakcja', 'oprac', 'tlum', 'tlumacz', 'ilustr', 'ilustrator', 'wstep',
+    'praca', 'zbiorowa', 'pod', 'wyd',
+    'von', 'van', 'der', 'de', 'la', 'du', 'jr', 'sr',
+))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def normalize(text):
+    # casefold and strip diacritics, "Łódź" and "lodz" give the same result
+    text = unicodedata.normalize('NFKD', text.casefold().translate(FOLD_TABLE))
+    text = ''.join(c if c.isalnum() else ' ' for c in text if not unicodedata.combining(c))
+    return ' '.join(text.split())
+
+
+def normalize_text(text):
+    return normalize(text or '')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def title_tokens(title):
+    tokens = frozenset(token for token in normalize(title or '').split() if len(token) > 1)
+    # a title made only of stop words still has to match itself
+    return tokens - TITLE_STOP_WORDS or tokens
+
+
+# initials ("J.", "J.R.R.") and one letter tokens are skipped, they rarely match between sources
+@lru_cache(maxsize=CACHE_SIZE)
+def author_tokens(author):
+    tokens = set()
+    for token in (author or '').split():
+        if not token.endswith('.'):
+            tokens.update(part for part in normalize(token).split() if len(part) > 1)
+    return frozenset(tokens - AUTHOR_STOP_WORDS)
+
+
+def authors_tokens(authors, only_first_author=False):
+    authors = tuple(authors or ())
+    return tuple_authors_tokens(authors[:1] if only_first_author else authors)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def tuple_authors_tokens(authors):
+    return frozenset().union(*(author_tokens(author) for author in authors))
+
@@ -1,28 +1,98 @@
 #!/usr/bin/env python3
-import re
 import copy
+import difflib
 import datetime
 import urllib.parse
 import socket
+import time
+import threading
+from queue import Queue, Empty
 
-import lxml.html
+import lxml.etree
 
 from calibre.ebooks.metadata.book.base import Metadata
 from calibre.utils.date import utc_tz
-from calibre_plugins.wbibliotece.network import Network
-from calibre_plugins.wbibliotece.utils import Utils
+from calibre_plugins.wbibliotece.network import Network, SingleFlight
+from calibre_plugins.wbibliotece.extractor import BookPage, FieldPlan, parse_page
+from calibre_plugins.wbibliotece.index import IdentifierIndex, isbn_key
+from calibre_plugins.wbibliotece.records import RecordCache, has_fields
+from calibre_plugins.wbibliotece.stats import Stats
+from calibre_plugins.wbibliotece.scheduler import run_workers
+from calibre_plugins.wbibliotece.covers import CoverStore, cover_cache
+from calibre_plugins.wbibliotece import fields
+from calibre_plugins.wbibliotece.normalize import normalize_text, title_tokens, author_tokens, authors_tokens
 from calibre_plugins.wbibliotece.metamover import Metamover
-from calibre_plugins.wbibliotece.config import URL_SCHEME_TITLE, URL_SCHEME_TITLE_AUTHORS, URL_SCHEME_ISBN, AUTHORS_JOIN_DELIMETER, AUTHORS_SPLIT_DELIMETER, SKIP_AUTHORS
+from calibre_plugins.wbibliotece.comments import build_comments
+from calibre_plugins.wbibliotece import prefs as settings
+from calibre_plugins.wbibliotece.prefs import URL_SCHEME_TITLE, URL_SCHEME_TITLE_AUTHORS, URL_SCHEME_ISBN, AUTHORS_JOIN_DELIMETER, AUTHORS_SPLIT_DELIMETER, SKIP_AUTHORS
+
+SEARCH_RESULTS = lxml.etree.XPath('//*[@id="results"]/div')
+SEARCH_RESULT_TITLE = lxml.etree.XPath('.//div/a[@class="result-title"]')
+SEARCH_RESULT_CREATORS = lxml.etree.XPath('.//div[@class="result-row result-creators"]/div[@class="content"]')
+SEARCH_KEEP_IDS = frozenset(('results',))
+
+# book pages parsed in this process right now, shared between identify jobs
+book_pages = SingleFlight()
+
+MIN_TITLE_SCORE = 0.3
+TITLE_SCORE_WEIGHT = 0.7
+# a search result this good ends the search, other queries are cancelled
+HIGH_CONFIDENCE = 0.9
+ISBN_SCORE = 1.0
+
+
+# log of a search that can be cancelled, its messages reach the job log only when the
+# result is used
+class SearchLog:
+    def __init__(self):
+        self.records = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.records.append((name, args, kwargs))
+
+    def replay(self, log):
+        for name, args, kwargs in self.records:
+            getattr(log, name)(*args, **kwargs)
 
 
 class Parser():
-    def __init__(self, plugin, log, timeout):
+    instances = {}
+    instances_lock = threading.Lock()
+
+    def __init__(self, plugin, log, timeout, abort=None):
         self.plugin = plugin
         self.log = log
         self.timeout = timeout
-        self.network = Network(timeout, log)
-        self.utils = Utils
-        self.metamover = Metamover
+        self.stats = Stats()
+        self.network = Network(timeout, log, self.prefs, self.stats, abort)
+        self.index = IdentifierIndex.get_instance(self.prefs)
+        self.records = RecordCache.get_instance(self.prefs)
+        self.cover_store = CoverStore.get_instance(self.prefs)
+        self.plan = FieldPlan.from_prefs(self.prefs)
+        self.metamover = Metamover()
+        self.found = {}
+        self.generation = settings.generation
+
+    # one Parser per prefs object for the whole process, every identify job gets a bound copy of it
+    @classmethod
+    def get_instance(cls, plugin, log, timeout, abort=None):
+        with cls.instances_lock:
+            parser = cls.instances.get(id(plugin.prefs))
+            if parser is None or parser.generation != settings.generation:
+                parser = cls.instances[id(plugin.prefs)] = cls(plugin, log, timeout, abort)
+        return parser.bind(plugin, log, timeout, abort)
+
+    def bind(self, plugin, log, timeout, abort=None, stats=None):
+        parser = object.__new__(type(self))
+        parser.__dict__.update(self.__dict__)
+        parser.plugin = plugin
+        parser.log = log
+        parser.timeout = timeout
+        parser.stats = stats if stats is not None else Stats()
+        parser.network = self.network.bind(timeout, log, parser.stats, abort)
+        parser.title, parser.authors = None, []
+        parser.found = {}
+        return parser
 
     @property
     def prefs(self):
@@ -42,17 +112,7 @@ class Parser():
         return authors_list
 
     def get_authors_tokens(self, authors, only_first_author=False):
-        authors_tokens = []
-
-        for author in authors:
-            for token in author.lower().split(' '):
-                if len(token) > 1 and not token.endswith('.'):
-                    authors_tokens.append(token)
-
-            if only_first_author:
-                break
-
-        return authors_tokens
+        return authors_tokens(authors, only_first_author)
 
     def create_authors_string(self, authors, only_first_author=False):
         if only_first_author:
@@ -75,196 +135,341 @@ class Parser():
 
         return (url, with_authors)
 
-    def parse_book_page_t(self, urls, result_queue, lock):
-        while True:
-            url = ''
-            with lock:
-                if urls:
-                    url = urls.pop()
-            if not url:
-                return
+    def parse_book_pages(self, urls, result_queue, abort):
+        def parse(url):
             mi = self.parse_book_page(url)
-            if mi:
+            if mi and not abort.is_set():
                 result_queue.put(mi)
-            if abort.is_set():
-                return
 
-    def parse_book_page(self, url):
+        run_workers(urls, parse, abort, self.log, self.prefs['max_threads'], self.prefs['thread_delay'])
+
+    def parse_book_page(self, url, plan=None):
+        plan = plan or self.plan
+        key = (url, plan.fields, plan.covers)
+        # without these fields the result carries the query title and authors
+        if 'title' not in plan or 'authors' not in plan:
+            key += (self.title, tuple(self.authors))
+        result, shared = book_pages.do(key, self.read_book_page, url, plan, abort=self.network.abort)
+        if result is None:
+            return None
+        mi, self.found[url] = result
+        if shared:
+            self.log.info('INFO: Joined book page parsing in progress: ' + url)
+            self.stats.add('coalesced_books')
+            mi = mi.deepcopy_metadata()
+        return mi
+
+    def read_book_page(self, url, plan):
+        identifier_id = fields.book_id(url)
+        record = self.records.get(identifier_id) if self.records is not None and identifier_id else None
+        if record is not None and has_fields(record, plan):
+            self.log.info('INFO: Found book in record cache: ' + identifier_id)
+            self.stats.add('record_hits')
+        else:
+            # fields of an older record are read again, so it keeps serving other prefs
+            if record is not None:
+                plan = FieldPlan(plan.fields | frozenset(record['fields']), plan.covers or record['covers'])
+            record = self.extract_record(url, plan)
+            if record is None:
+                return
+            if self.records is not None and identifier_id:
+                self.records.put(identifier_id, record)
+        # what the page says about the book, the metadata can carry query values
+        found = {name: record.get(name) for name in ('title', 'authors', 'isbn')}
+        return self.build_metadata(record, plan, identifier_id), found
+
+    # every field the plan asks for, as plain json types
+    def extract_record(self, url, plan):
         self.log.info('INFO: Downloading book page: ' + url)
-        resp = self.network.download_page(url)
+        resp = self.network.download_page(url, 'book')
         if not resp:
             return
 
         self.log.info('INFO: Parsing book page')
 
-        tree = lxml.html.parse(resp)
-        root = tree.getroot()
-        book_tag = root.find('.//*[@id="work"]')
-        seriesTag = root.xpath('.//*[@id="work"]//div//div//div//table//th[starts-with(text(),"Wydane w seriach:")]//following-sibling::td//span')
+        start = time.perf_counter()
+        root = parse_page(resp, plan.keep_ids, plan.keep_classes, plan.stop_after)
+        page = BookPage(root, plan)
+        record = {'fields': sorted(plan.fields), 'covers': plan.covers}
+        if plan.series:
+            record['series'] = page.get_series()
+        publishers = [tag.text_content().strip() for tag in page.get_publishers()] if plan.publishers else []
+
+        if 'title' in plan:
+            record['title'] = page.get_title()
+            self.log.info('book_title', record['title'])
+        if 'authors' in plan:
+            book_authors = page.get_authors()
+            record['authors'] = self.get_authors(book_authors, name_reversed=True) if book_authors else []
+
+        if 'publisher' in plan and publishers:
+            record['publisher'] = fields.clean_publisher(publishers[-1])
+
+        if 'pubdate' in plan:
+            record['pubdate'] = fields.parse_year(page.get_pubdate())
+            # If no pubdate in main summary check publishers list for first edition and extract year
+            record['editions'] = fields.edition_years(publishers) if publishers else None
 
-        # Different publisher sources
-        publishersTag = root.xpath('.//*[@id="work"]//div//div//div//table//th[starts-with(text(), "Wydawc")]//following-sibling::td//div')
-        if not publishersTag:
-            publishersTag = root.xpath('.//table[@id="details"]//tr//th[starts-with(text(),"Wydawc")]//following-sibling::td/span[normalize-space(text())]')
+        if 'comments' in plan:
+            record['comments'] = build_comments(page.get_comments())
+            #METAMOVER
+            record['sections'] = self.metamover.parseMetaSections(page)
 
-        if self.prefs['title']:
-            book_title = root.find('.//*[@id="work"]//div//div//div//div//div/h1/span[@class="main-title"]').text_content().strip()
-            self.log.info('book_title', book_title)
-        else:
-            book_title = self.title
-        if self.prefs['authors']:
-            book_authors = root.xpath('.//*[@id="work"]//div//div//div//table//div[@itemprop="creator"]')
-            if book_authors:
-                book_authors = book_authors[0].text_content().partition('(')[0].strip()
-                book_authors = self.get_authors(book_authors, name_reversed=True)
-        else:
-            book_authors = self.authors
-        mi = Metadata(book_title, book_authors)
+        if 'rating' in plan:
+            record['rating'] = fields.parse_rating(page.get_rating())
 
-        if self.prefs['publisher']:
-            tag = publishersTag
-            if tag:
-                tag = tag[-1].text_content().strip()
-                tag = re.sub(r'\(.*?\)', '', tag)
-                mi.publisher = tag
+        if 'tags' in plan:
+            record['tags'] = [str(tag) for tag in page.get_tags()]
+            gen = page.get_genres()
+            record['genres'] = gen[0].split("/") if gen else []
 
-        if self.prefs['pubdate']:
-            tag = root.xpath('.//*[@id="work"]//div//div//div//table//th[starts-with(text(),"Wyd. w latach:")]//following-sibling::td')
-            if tag:
-                tag = tag[0].text_content().strip()
-                tag = re.search(r"\b\d{4}\b", tag).group()
-                mi.pubdate = datetime.datetime(int(tag), 1, 1, tzinfo=utc_tz)
-            # If no pubdate in main summary check publishers list for first edition and extract year
-            elif publishersTag:
-                tag = self.utils.find_earliest_year(publishersTag)
-                if tag is not None:
-                    mi.pubdate = datetime.datetime(int(tag), 1, 1, tzinfo=utc_tz)
+        if 'isbn' in plan:
+            record['isbn'] = page.get_isbn()
+
+        if plan.covers:
+            record['cover_urls'] = page.get_covers()
+
+        self.stats.add('book_pages')
+        self.stats.add('xpath_queries', page.queries)
+        self.stats.add_time('parse_book', time.perf_counter() - start)
+        self.log.info('INFO: Parsing book page completed')
+        return record
+
+    def build_metadata(self, record, plan, identifier_id):
+        book_title = self.title
+        if 'title' in plan:
+            book_title = record['title'] or self.title
+        book_authors = self.authors
+        if 'authors' in plan:
+            book_authors = record['authors']
+        mi = Metadata(book_title, book_authors)
 
-        if self.prefs['comments']:
-            tagComments = root.xpath('.//*[@id="work"]//div//div//div//table//tr[@class="summary"]//div[contains(@class, "summary-preview")]')
+        if 'publisher' in plan and record.get('publisher'):
+            mi.publisher = record['publisher']
+
+        if 'pubdate' in plan:
+            year = record['pubdate']
+            editions = record['editions']
+            if editions:
+                self.log.info('INFO: Editions: {2}, published {0}-{1}'.format(*editions))
+                year = year or editions[0]
+            if year:
+                mi.pubdate = datetime.datetime(year, 1, 1, tzinfo=utc_tz)
+
+        if 'comments' in plan:
+            tagComments = record['comments'] or ''
+            if self.prefs['metamoverenabled']:
+                tagComments += self.metamover.formatMetaMoverComment(record.get('sections', {}), self.prefs)
             if tagComments:
-                tagComments = tagComments[0].text_content()
-                #METAMOVER
-                if self.prefs['metamoverenabled']:
-                    tagComments = tagComments + self.metamover.formatMetaMoverComment(root);
                 mi.comments = tagComments
 
-        if self.prefs['languages']:
+        if 'languages' in plan:
             mi.languages = ['pl']
 
-        if self.prefs['rating']:
-            tag = root.xpath('.//*[@id="work"]//div//div//div//table//span[@itemprop="ratingValue"]')
-            if tag:
-                tag = tag[0].text_content().strip()
-                tag = float(tag)
-                tag = round(tag, 0)
-                mi.rating = tag
-
-        if self.prefs['tags']:
-            tag = root.xpath('//a[@class="tag"]/text()')
+        if 'rating' in plan and record['rating'] is not None:
+            mi.rating = round(record['rating'], 0)
 
-            # Series as tag
-            ser = seriesTag
-            ser = [s.text_content().strip() for s in ser]
+        if 'tags' in plan:
+            # Series and genre as tag
+            tags = record['tags'] + record['series'] + record['genres']
+            if tags:
+                mi.tags = tags
 
-            # Genre as tag
-            gen = root.xpath('.//*[@class="spreadme-product"]/span[starts-with(text(),"Gatunek:")]/following-sibling::span')
-            gen = [s.text_content().strip() for s in gen]
+        if 'series' in plan and record['series']:
+            mi.series = record['series'][0]
 
-            if tag:
-                mi.tags = tag
-            if ser:
-                mi.tags = mi.tags + ser
-            if gen:
-                mi.tags = mi.tags + gen[0].split("/")
-
-        if self.prefs['series']:
-            tag = seriesTag
-            if tag:
-                tag = tag[0].text_content().strip()
-                mi.series = tag
+        if 'isbn' in plan and record['isbn']:
+            self.log.info('ISBN: ', record['isbn'])
+            mi.isbn = record['isbn']
 
-        if self.prefs['isbn']:
-            tag = root.xpath('.//*[@id="work"]//div//div//div//table//span[@data-ipub-search="isbn"]')
-            if tag:
-                tag = tag[0].text_content().strip()
-                self.log.info('ISBN: ', tag)
-                mi.isbn = tag
-
-        if self.prefs['identifier']:
-            identifier_id = re.search(r"\b\d+\b", url).group()
+        if 'identifier' in plan and identifier_id:
             mi.set_identifier(self.plugin.IDENTIFIER, identifier_id)
 
-        if self.prefs['covers']:
-            tag = root.xpath('.//*[@id="work"]//div//div[@id="covers"]//following-sibling::div[@class="box"]//a//@href')
-            self.log.info('tag', tag[0])
-            for coverImage in tag:
-                cover_url = "https:" + coverImage
-                if cover_url:
-                    mi.has_cover = True
-                    self.log.info('INFO: Cover found: ' + cover_url)
-                    urls = self.plugin.cached_identifier_to_cover_url('urls')
-                    urls.append(cover_url)
-                else:
-                    mi.has_cover = False
-                    self.log.warn('WARN: Cover is not available')
-                    self.plugin.cache_identifier_to_cover_url('nocover', True)
-
-        self.log.info('INFO: Parsing book page completed')
+        if plan.covers:
+            tag = record['cover_urls']
+            for cover_url in tag:
+                self.log.info('INFO: Cover found: ' + cover_url)
+            if tag:
+                mi.has_cover = True
+            else:
+                self.log.warn('WARN: Cover is not available')
+            # also cached when empty, download_cover then knows the book has no cover
+            cover_cache.put({self.plugin.IDENTIFIER: identifier_id, 'isbn': mi.isbn}, tag, self.cover_store)
         return mi
 
-    def parse_search_page(self, title, authors, with_authors=False, only_first_author=False):
-        results = []
-        authors = authors or []
-        self.authors = copy.copy(authors)
+    # only the best ranked book and books with the query ISBN on their page are indexed, other
+    # search results may be different books with a similar title
+    def index_books(self, urls, isbn=None):
+        if self.index is None:
+            return
+        for rank, url in enumerate(urls):
+            found = self.found.get(url)
+            book_id = fields.book_id(url)
+            if found is None or not book_id:
+                continue
+            if rank == 0 or (isbn and found['isbn'] and isbn_key(found['isbn']) == isbn_key(isbn)):
+                self.index.add(book_id, found['title'], found['authors'], found['isbn'])
+
+    def get_search_results(self, root):
+        self.stats.add('search_pages')
+        self.stats.add('xpath_queries')
+        for book_record in SEARCH_RESULTS(root):
+            self.stats.add('xpath_queries', 2)
+            title_tag = SEARCH_RESULT_TITLE(book_record)
+            if not title_tag or not title_tag[0].get('href'):
+                continue
+            authors_tag = SEARCH_RESULT_CREATORS(book_record)
+            book_authors = authors_tag[0].text_content().strip() if authors_tag else ''
+            yield (title_tag[0].text_content().strip(), book_authors, 'https://w.bibliotece.pl' + title_tag[0].get('href'))
+
+    def score_search_result(self, title_norm, query_title_tokens, query_authors_tokens, book_title, book_authors):
+        book_title_tokens = title_tokens(book_title)
+        book_title = normalize_text(book_title)
+        title_score = 0.0
+        if query_title_tokens:
+            # token overlap finds reordered titles, edit distance rewards titles without extra words
+            overlap = len(query_title_tokens & book_title_tokens) / len(query_title_tokens)
+            title_score = (overlap + difflib.SequenceMatcher(None, title_norm, book_title).ratio()) / 2
+
+        authors_score = 0.0
+        if query_authors_tokens:
+            book_authors_tokens = author_tokens(book_authors)
+            authors_score = len(query_authors_tokens & book_authors_tokens) / len(query_authors_tokens)
+        return (title_score, authors_score)
+
+    def set_query(self, title, authors):
         self.title = title
-        authors = [a for a in authors if not a in SKIP_AUTHORS]
-        authors_string = self.create_authors_string(authors, only_first_author)
-        url, with_authors = self.create_search_page_url(title, authors_string, with_authors)
+        self.authors = copy.copy(authors or [])
 
-        self.log.info('INFO: Downloading search page: ' + url)
-        resp = self.network.download_page(url)
+    def read_isbn_search_page(self, url):
+        self.log.info('INFO: Downloading ISBN search page: ' + url)
+        resp = self.network.download_page(url, 'search')
         if not resp:
-            return results
-
-        self.log.info('INFO: Parsing search page')
+            return []
 
-        tree = lxml.html.parse(resp)
-        root = tree.getroot()
-
-        title_tokens = [token for token in title.lower().split(' ') if len(token) > 1]
-        authors_tokens = self.get_authors_tokens(authors)
-        for book_record in root.xpath('//*[@id="results"]/div'):
-            title_match = False
-            author_match = not bool(authors_tokens) or not with_authors
-            title_tag = root.find('.//div/a[@class="result-title"]')
+        # an ISBN query is exact, every result is a match
+        with self.stats.timer('parse_search'):
+            root = parse_page(resp, SEARCH_KEEP_IDS, stop_after=SEARCH_KEEP_IDS)
+            results = [href for book_title, book_authors, href in self.get_search_results(root)]
+        self.log.info('INFO: ISBN search results: {}'.format(len(results)))
+        return results
 
-            book_title = root.find('.//div/a[@class="result-title"]')
-            book_authors = root.find('.//*[@id="results"]/div/div/div[@class="result-row result-creators"]/div[@class="content"]')
+    # (score, href) of the matching results, best first
+    def read_search_page(self, url, title, authors, with_authors):
+        self.log.info('INFO: Downloading search page: ' + url)
+        resp = self.network.download_page(url, 'search')
+        if not resp:
+            return []
 
-            if book_authors:
-                book_authors = book_authors.text_content().strip().lower()
-            if book_title:
-                book_title = book_title.text_content().strip().lower()
+        self.log.info('INFO: Parsing search page')
 
-            for token in title_tokens:
-                if token in book_title:
-                    title_match = True
-                    break
-            if not author_match:
-                for token in authors_tokens:
-                    if token in book_authors:
-                        author_match = True
-            if title_match and author_match:
-                self.log.info('INFO: Match found: title: {}, author(s): {}'.format(
-                    book_title, book_authors))
-                results.append('https://w.bibliotece.pl' + title_tag.attrib['href'])
+        start = time.perf_counter()
+        root = parse_page(resp, SEARCH_KEEP_IDS, stop_after=SEARCH_KEEP_IDS)
+        title_norm = normalize_text(title)
+        query_title_tokens = title_tokens(title)
+        query_authors_tokens = self.get_authors_tokens(authors)
+
+        candidates = []
+        for book_title, book_authors, href in self.get_search_results(root):
+            title_score, authors_score = self.score_search_result(title_norm, query_title_tokens, query_authors_tokens, book_title, book_authors)
+            if title_score >= MIN_TITLE_SCORE and (authors_score or not query_authors_tokens or not with_authors):
+                score = TITLE_SCORE_WEIGHT * title_score + (1 - TITLE_SCORE_WEIGHT) * authors_score
+                self.log.info('INFO: Match found: title: {}, author(s): {}, score: {:.2f}'.format(
+                    book_title, book_authors, score))
+                candidates.append((score, href))
             else:
                 self.log.warn('WARN: No match: title: {}, author(s): {}'.format(
                     book_title, book_authors))
 
-        if not results and with_authors:
-            return self.parse_search_page(title, authors, False)
-
+        # best candidates first, so max_results fetches the most likely book pages
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        self.stats.add_time('parse_search', time.perf_counter() - start)
         self.log.info('INFO: Parsing search page completed')
-        return results
+        return candidates
+
+    # (name, url, with_authors) of every query worth sending, most specific first
+    def plan_searches(self, title, authors, isbn=None):
+        searches = []
+        if isbn:
+            searches.append(('isbn', URL_SCHEME_ISBN.format(isbn=urllib.parse.quote(isbn)), False))
+        authors = [a for a in authors or [] if not a in SKIP_AUTHORS]
+        if self.prefs['authors_search'] and authors:
+            searches.append(('title and first author',) + self.create_search_page_url(title, self.create_authors_string(authors, True), True))
+            if not self.prefs['only_first_author']:
+                searches.append(('title and authors',) + self.create_search_page_url(title, self.create_authors_string(authors), True))
+        searches.append(('title',) + self.create_search_page_url(title, '', False))
+
+        urls = set()
+        planned = []
+        for name, url, with_authors in searches:
+            if url and url not in urls:
+                urls.add(url)
+                planned.append((name, url, with_authors))
+        return planned
+
+    def run_search(self, search):
+        name, url, with_authors = search
+        if name == 'isbn':
+            return [(ISBN_SCORE, href) for href in self.read_isbn_search_page(url)]
+        return self.read_search_page(url, self.title, self.authors, with_authors)
+
+    def run_search_t(self, priority, search, done):
+        candidates = []
+        try:
+            candidates = self.run_search(search)
+        except Exception as e:
+            self.log.error('ERROR: Search failed: ' + search[1])
+            self.log.exception(e)
+        finally:
+            done.put((priority, search, candidates, self))
+
+    # Sends the planned queries at once and merges their results. A high confidence match
+    # cancels the queries still running. Without parallel the queries run in order and the
+    # first one with results wins, like the title search falling back to title only.
+    def search(self, title, authors, isbn=None, parallel=True):
+        searches = self.plan_searches(title, authors, isbn)
+        best = {}
+
+        def merge(priority, candidates):
+            for score, href in candidates:
+                # equal scores prefer the more specific query
+                rank = (score, -priority)
+                if href not in best or rank > best[href]:
+                    best[href] = rank
+
+        abort = self.network.abort
+        if not parallel or len(searches) < 2:
+            for priority, search in enumerate(searches):
+                merge(priority, self.run_search(search))
+                if best or (abort is not None and abort.is_set()):
+                    break
+        else:
+            stop = threading.Event()
+            done = Queue()
+            for priority, search in enumerate(searches):
+                # every query logs and counts on its own and stops with the search, a cancelled
+                # query that still finishes leaves the job log and stats alone
+                parser = self.bind(self.plugin, SearchLog(), self.timeout, stop)
+                parser.set_query(title, authors)
+                threading.Thread(target=parser.run_search_t, args=(priority, search, done), daemon=True).start()
+
+            pending = len(searches)
+            self.stats.add('searches', pending)
+            while pending:
+                try:
+                    priority, search, candidates, parser = done.get(timeout=0.1)
+                except Empty:
+                    if abort is not None and abort.is_set():
+                        break
+                    continue
+                pending -= 1
+                parser.log.replay(self.log)
+                self.stats.merge(parser.stats)
+                merge(priority, candidates)
+                if pending and candidates and candidates[0][0] >= HIGH_CONFIDENCE:
+                    self.log.info('INFO: High confidence match from {} search, cancelling {} other searches'.format(search[0], pending))
+                    self.stats.add('searches_cancelled', pending)
+                    break
+            stop.set()
+
+        return [href for href, rank in sorted(best.items(), key=lambda item: item[1], reverse=True)]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# plugin constants and pref defaults, kept free of Qt so identify jobs never load the GUI libraries
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+from calibre.utils.config import JSONConfig
+
+__license__ = 'MIT'
+__copyright__ = '2023 l4red0'
+__docformat__ = 'restructuredtext en'
+
+
+IDENTIFIER = 'wbibliotece'
+
+URL_SCHEME_TITLE = 'https://w.bibliotece.pl/search/?q=t%3A{title}'
+URL_SCHEME_TITLE_AUTHORS = 'https://w.bibliotece.pl/search/?q=o%3A{authors}+t%3A{title}'
+URL_SCHEME_ISBN = 'https://w.bibliotece.pl/search/?q=isbn%3A+{isbn}'
+
+AUTHORS_JOIN_DELIMETER = '+'
+AUTHORS_SPLIT_DELIMETER = '+'
+SKIP_AUTHORS = ('Unknown', 'Nieznany')
+
+prefs = JSONConfig('plugins/{}'.format(IDENTIFIER))
+
+# bumped when the config widget saves, objects built from prefs once per process are rebuilt
+generation = 0
+
+
+def changed():
+    global generation
+    generation += 1
+
+
+prefs.defaults['max_results'] = 2
+prefs.defaults['authors_search'] = True
+prefs.defaults['only_first_author'] = False
+prefs.defaults['covers'] = True
+prefs.defaults['max_covers'] = 5
+prefs.defaults['threads'] = True
+prefs.defaults['max_threads'] = 3
+prefs.defaults['thread_delay'] = 0.1
+
+# response cache
+prefs.defaults['cache'] = True
+prefs.defaults['cache_max_size'] = 100
+prefs.defaults['cache_ttl_search'] = 24
+prefs.defaults['cache_ttl_book'] = 168
+prefs.defaults['identifier_index'] = True
+prefs.defaults['stats_file'] = ''
+prefs.defaults['requests_per_second'] = 4.0
+prefs.defaults['max_retries'] = 3
+
+# metadata settings
+prefs.defaults['title'] = True
+prefs.defaults['authors'] = True
+prefs.defaults['pubdate'] = True
+prefs.defaults['publisher'] = True
+prefs.defaults['series'] = True
+prefs.defaults['isbn'] = True
+prefs.defaults['comments'] = True
+prefs.defaults['languages'] = True
+prefs.defaults['rating'] = True
+prefs.defaults['tags'] = True
+prefs.defaults['identifier'] = True
+
+# additional metadata (metamover)
+prefs.defaults['metamoverenabled'] = False
+prefs.defaults['translators'] = True
+prefs.defaults['illustrators'] = True
+prefs.defaults['original_title'] = True
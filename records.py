@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Fields extracted from book pages, keyed by wbibliotece id. Metadata is rebuilt from a record
+# for the current field prefs, so a known book needs neither the network nor lxml.
+import json
+import time
+import zlib
+
+from calibre_plugins.wbibliotece.storage import Store, guarded
+
+MAX_RECORDS = 20000
+
+
+class RecordCache(Store):
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS records (
+            book_id TEXT PRIMARY KEY,
+            record BLOB NOT NULL,
+            fetched REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS records_accessed ON records (accessed);
+    '''
+    NAME = 'records'
+    TABLE = 'records'
+    KEY = 'book_id'
+    limit = MAX_RECORDS
+    ttl = 0
+
+    # shares the cache switch and the book page ttl with the response cache
+    @classmethod
+    def enabled(cls, prefs):
+        return prefs['cache'] and prefs['cache_ttl_book']
+
+    def configure(self, prefs):
+        self.ttl = prefs['cache_ttl_book'] * 3600
+
+    @guarded()
+    def get(self, book_id):
+        conn = self.connect()
+        row = conn.execute('SELECT record, fetched FROM records WHERE book_id = ?', (book_id,)).fetchone()
+        if not row or time.time() - row[1] > self.ttl:
+            return None
+        with conn:
+            conn.execute('UPDATE records SET accessed = ? WHERE book_id = ?', (time.time(), book_id))
+        try:
+            return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+        except (zlib.error, ValueError):
+            return None
+
+    @guarded()
+    def put(self, book_id, record):
+        data = zlib.compress(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)', (book_id, data, now, now))
+        self.evict()
+
+
+# a record can serve a plan when every field the plan needs was extracted
+def has_fields(record, plan):
+    return plan.fields.issubset(record['fields']) and (record['covers'] or not plan.covers)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import time
+import random
+import threading
+import email.utils
+from queue import Queue, Empty
+from contextlib import contextmanager
+
+from calibre_plugins.wbibliotece.storage import Store, guarded
+
+RETRY_CODES = (429, 500, 502, 503, 504)
+THROTTLE_CODES = (429, 503)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# latency above this multiple of the best seen latency counts as congestion
+LATENCY_FACTOR = 3.0
+MIN_RATE = 0.2
+RATE_NAME = 'w.bibliotece.pl'
+
+
+# request slots shared by every calibre worker process, so requests_per_second holds for the
+# site and not for each process. One row per limited name, tat is the time its bucket is full
+# again (generic cell rate algorithm).
+class RateStore(Store):
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS rate (
+            name TEXT PRIMARY KEY,
+            tat REAL NOT NULL
+        );
+    '''
+    NAME = 'rate'
+    TABLE = 'rate'
+    KEY = 'name'
+
+    # 0 when a slot was taken, otherwise seconds to wait, None when the store failed
+    @guarded()
+    def take(self, name, interval, burst):
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tat FROM rate WHERE name = ?', (name,)).fetchone()
+            tat = row[0] if row else now
+            # never further ahead than a full burst, unless the clock was set back
+            if tat < now or tat > now + burst * interval:
+                tat = now
+            wait = tat - now - (burst - 1) * interval
+            if wait > 0:
+                return wait
+            conn.execute('INSERT OR REPLACE INTO rate VALUES (?, ?)', (name, tat + interval))
+        return 0
+
+
+class Scheduler:
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, rate, max_concurrency, max_retries, shared=None):
+        self.cond = threading.Condition()
+        self.shared = shared
+        self.rate = max(rate, MIN_RATE)
+        self.limit = float(max(max_concurrency, 1))
+        self.configure(rate, max_concurrency, max_retries)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.active = 0
+        self.latency = None
+        self.best_latency = None
+
+    # one scheduler per process, shared by every identify and cover job
+    @classmethod
+    def get_instance(cls, prefs):
+        rate = prefs['requests_per_second']
+        max_concurrency = max(prefs['max_threads'], 1) * 2
+        with cls.instance_lock:
+            if cls.instance is None:
+                cls.instance = cls(rate, max_concurrency, prefs['max_retries'], RateStore.get_instance(prefs))
+            else:
+                cls.instance.configure(rate, max_concurrency, prefs['max_retries'])
+            return cls.instance
+
+    def configure(self, rate, max_concurrency, max_retries):
+        with self.cond:
+            self.max_rate = max(rate, MIN_RATE)
+            self.burst = max(max_concurrency, 1)
+            self.max_concurrency = max(max_concurrency, 1)
+            self.max_retries = max(max_retries, 0)
+            self.rate = min(self.rate, self.max_rate)
+            self.limit = min(self.limit, self.max_concurrency)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # blocks until both a concurrency slot and a rate token are free
+    @contextmanager
+    def slot(self, abort=None):
+        while True:
+            with self.cond:
+                while True:
+                    if abort is not None and abort.is_set():
+                        raise Aborted()
+                    self.refill()
+                    if self.active < int(self.limit) and self.tokens >= 1:
+                        break
+                    wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.1
+                    self.cond.wait(min(max(wait, 0.01), 0.1))
+
+            # this process has a token, the other worker processes may have used the site's. The
+            # store can wait for their file lock, so it is asked without holding the condition.
+            wait = self.shared.take(RATE_NAME, 1 / self.rate, self.burst) if self.shared is not None else 0
+            if wait:
+                time.sleep(min(max(wait, 0.01), 0.1))
+                continue
+            with self.cond:
+                # another thread may have taken the last concurrency slot in the meantime
+                if self.active < int(self.limit):
+                    self.refill()
+                    self.tokens -= 1
+                    self.active += 1
+                    break
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.active -= 1
+                self.cond.notify_all()
+
+    def record(self, latency, status=None):
+        with self.cond:
+            if status is None or status in RETRY_CODES:
+                # multiplicative decrease on errors, throttling also slows the request rate
+                self.limit = max(1.0, self.limit / 2)
+                if status in THROTTLE_CODES:
+                    self.rate = max(MIN_RATE, self.rate / 2)
+            else:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                self.best_latency = latency if self.best_latency is None else min(self.best_latency, latency)
+                if self.latency > LATENCY_FACTOR * self.best_latency:
+                    self.limit = max(1.0, self.limit - 0.5)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+                    self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            self.cond.notify_all()
+
+    def backoff(self, attempt, retry_after=None):
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+        return min(delay, BACKOFF_MAX)
+
+
+class Aborted(Exception):
+    pass
+
+
+# calls func for every item on up to threads worker threads, results are returned in items order.
+# An item that raises is logged and left as None, the worker goes on with the next one.
+def run_workers(items, func, abort, log, threads, delay=0):
+    queue = Queue()
+    for i, item in enumerate(items):
+        queue.put((i, item))
+    results = [None] * len(items)
+
+    def worker():
+        while not abort.is_set():
+            try:
+                i, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[i] = func(item)
+            except Exception as e:
+                log.error('ERROR: Failed to process: {}'.format(item))
+                log.exception(e)
+
+    workers = []
+    for i in range(min(max(threads, 1), len(items))):
+        # stagger worker start, abort.wait returns early when the job is cancelled
+        if i and abort.wait(delay):
+            break
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        workers.append(thread)
+
+    for thread in workers:
+        while thread.is_alive() and not abort.is_set():
+            thread.join(0.1)
+    return results
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def merge(self, other):
+        counters, timers = other.snapshot()
+        with self.lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, value in timers.items():
+                self.timers[name] = self.timers.get(name, 0.0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), dict(self.timers)
+
+    def summary(self):
+        counters, timers = self.snapshot()
+        parts = ['{}={}'.format(name, value) for name, value in sorted(counters.items())]
+        parts += ['{}={:.3f}s'.format(name, value) for name, value in sorted(timers.items())]
+        return ' '.join(parts)
+
+    def to_json(self):
+        counters, timers = self.snapshot()
+        return {'time': time.time(), 'counters': counters, 'timers': timers}
+
+    def dump(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(), f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+
+# aggregated over every identify and download_cover call in this process
+totals = Stats()
+
+
+# calibre runs bulk downloads in several worker processes, each one writes its own file with
+# the pid before the extension, stats.json becomes stats.1234.json
+def stats_path(path):
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, os.getpid(), ext)
+
+
+def report(log, name, stats, prefs):
+    log.info('INFO: {} summary: {}'.format(name, stats.summary()))
+    totals.merge(stats)
+    path = prefs['stats_file']
+    if path:
+        path = stats_path(path)
+        try:
+            totals.dump(path)
+        except OSError as e:
+            log.error('ERROR: Could not write stats file: ' + path)
+            log.exception(e)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# SQLite files shared by every calibre worker process. WAL lets readers work while another process
+# writes, a damaged file is moved aside and recreated instead of failing identify.
+import os
+import time
+import sqlite3
+import functools
+import threading
+
+from calibre.constants import config_dir
+from calibre_plugins.wbibliotece.prefs import IDENTIFIER
+
+BUSY_TIMEOUT = 30
+
+
+def store_path(name):
+    return os.path.join(config_dir, 'plugins', '{}_{}.sqlite'.format(IDENTIFIER, name))
+
+
+# inode of the file, tells whether another process already replaced it
+def file_id(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+# locked or damaged stores behave like an empty cache, the method returns default
+def guarded(default=None):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.DatabaseError as e:
+                self.failed(e)
+                return default
+        return wrapper
+    return decorator
+
+
+class Store:
+    SCHEMA = ''
+    # file name in the plugins directory
+    NAME = ''
+    # rows of TABLE are evicted by KEY, least recent ORDER first, until the sum of WEIGHT fits limit
+    TABLE = ''
+    KEY = ''
+    ORDER = 'accessed'
+    WEIGHT = '1'
+    limit = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # bumped on recovery, threads then reopen their connections
+        self.epoch = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            self.connect()
+        except sqlite3.DatabaseError as e:
+            # guarded methods connect again on their next call
+            self.failed(e)
+
+    @classmethod
+    def enabled(cls, prefs):
+        return True
+
+    # one store per file for the whole process, None when switched off in prefs
+    @classmethod
+    def get_instance(cls, prefs):
+        if not cls.enabled(prefs):
+            return None
+        store = cls.get_store()
+        # limits are re-read so changes in the config widget apply without restart
+        store.configure(prefs)
+        return store
+
+    # also when switched off, clearing and export work on the file anyway
+    @classmethod
+    def get_store(cls):
+        with Store.instance_lock:
+            store = cls.__dict__.get('instance')
+            if store is None:
+                store = cls.instance = cls(store_path(cls.NAME))
+            return store
+
+    def configure(self, prefs):
+        pass
+
+    def open(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        try:
+            conn.execute('PRAGMA busy_timeout = {}'.format(BUSY_TIMEOUT * 1000))
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            with conn:
+                conn.executescript(self.SCHEMA)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    # sqlite connections can't be shared between threads, keep one per thread
+    def connect(self):
+        local = self.local
+        if getattr(local, 'epoch', None) != self.epoch:
+            conn = getattr(local, 'conn', None)
+            if conn is not None:
+                conn.close()
+            local.conn = None
+            local.file = file_id(self.path)
+            local.conn = self.open()
+            local.epoch = self.epoch
+        return local.conn
+
+    def failed(self, error):
+        # busy and full disk errors are temporary, only a damaged file is replaced
+        if isinstance(error, (sqlite3.OperationalError, sqlite3.IntegrityError)):
+            return
+        self.recover()
+
+    def recover(self):
+        with self.lock:
+            # the file this thread opened, when it is not at the path any more another
+            # process or thread already recovered and a reconnect is enough
+            if file_id(self.path) == getattr(self.local, 'file', None):
+                aside = '{}.corrupt-{}'.format(self.path, int(time.time()))
+                for suffix in ('', '-wal', '-shm'):
+                    try:
+                        os.replace(self.path + suffix, aside + suffix)
+                    except OSError:
+                        # open files can't be renamed on Windows, the store keeps failing soft
+                        pass
+            self.epoch += 1
+
+    def weight(self, conn):
+        return conn.execute('SELECT COALESCE(SUM({}), 0) FROM {}'.format(self.WEIGHT, self.TABLE)).fetchone()[0]
+
+    # drops least recently used rows until 90% of the limit is free. Other processes share the
+    # file, so the weight is read again under the write lock before anything is deleted.
+    @guarded()
+    def evict(self):
+        if self.limit is None:
+            return
+        conn = self.connect()
+        if self.weight(conn) <= self.limit:
+            return
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            excess = self.weight(conn) - self.limit
+            if excess <= 0:
+                return
+            excess += self.limit - int(self.limit * 0.9)
+            keys = []
+            for key, weight in conn.execute('SELECT {}, {} FROM {} ORDER BY {}'.format(self.KEY, self.WEIGHT, self.TABLE, self.ORDER)):
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= weight
+            conn.executemany('DELETE FROM {} WHERE {} = ?'.format(self.TABLE, self.KEY), keys)
+
+    @guarded()
+    def clear(self):
+        conn = self.connect()
+        with conn:
+            conn.execute('DELETE FROM ' + self.TABLE)
+        conn.execute('VACUUM')
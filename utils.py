@@ -1,21 +1,43 @@
-import re
+import struct
 
 
 class Utils:
     def __init__(self, log):
         self.log = log
 
-    def find_earliest_year(publishers):
-        pattern = r"\(\d{4}\)|\(\d{4}-\d{4}\)"
-        years = []
-        for publisher in publishers:
-            publisher = publisher.text_content().strip()
-            match = re.search(pattern, publisher)
-            if not match:
-                continue
-            match = match.group().strip("()")
-            if '-' in match:
-                years += [int(year) for year in match.split("-")]
-            else:
-                years.append(int(match))
-        return str(min(years)) if len(years) > 0 else None
+    def get_image_size(data):
+        # read dimensions from the image header only, returns (width, height) or None
+        if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR' and len(data) >= 24:
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+            return struct.unpack('<HH', data[6:10])
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            chunk = data[12:16]
+            if chunk == b'VP8 ' and len(data) >= 30:
+                width, height = struct.unpack('<HH', data[26:30])
+                return (width & 0x3fff, height & 0x3fff)
+            if chunk == b'VP8L' and len(data) >= 25:
+                bits = int.from_bytes(data[21:25], 'little')
+                return ((bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1)
+            if chunk == b'VP8X' and len(data) >= 30:
+                return (int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1)
+            return None
+        if data[:2] == b'\xff\xd8':
+            pos = 2
+            while pos + 9 < len(data):
+                if data[pos] != 0xff:
+                    pos += 1
+                    continue
+                marker = data[pos + 1]
+                if marker == 0xff:
+                    pos += 1
+                    continue
+                # SOFn markers carry the frame size, skip DHT (c4), JPG (c8) and DAC (cc)
+                if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                    height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+                    return (width, height)
+                if marker == 0xd8 or 0xd0 <= marker <= 0xd7:
+                    pos += 2
+                    continue
+                pos += 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        return None